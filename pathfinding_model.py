@@ -1,19 +1,338 @@
+import heapq
+import math
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from weakref import WeakValueDictionary
+
+import numpy as np
+
 from mesa import Agent, Model
 from mesa.space import MultiGrid
 from mesa.time import BaseScheduler
 from mesa.datacollection import DataCollector
 
+# Estados por los que pasa un paquete, en orden
+PACKAGE_STATUSES = ('waiting', 'assigned', 'picked', 'delivered')
+
+
+def optional_column(name):
+    """Propiedad de Package sobre una columna de la tabla en la que -1 significa None"""
+    def getter(self):
+        value = getattr(self.store, name)[self.row]
+        return None if value < 0 else int(value)
+
+    def setter(self, value):
+        getattr(self.store, name)[self.row] = PackageStore.NONE if value is None else value
+
+    return property(getter, setter)
+
+
 class Package:
-    """Representa un paquete que debe ser recogido y entregado"""
-    def __init__(self, package_id, pickup_location, delivery_location):
-        self.id = package_id
-        self.pickup_location = pickup_location  # Posición de recogida (camión)
-        self.delivery_location = delivery_location  # Posición de entrega (góndola)
-        self.status = 'waiting'  # waiting, assigned, picked, delivered
-        self.assigned_robot_id = None
-        self.pickup_time = None
-        self.delivery_time = None
-        self.assignment_time = None  
+    """Representa un paquete que debe ser recogido y entregado.
+
+    Es una vista ligera (tabla, fila) sobre PackageStore: cada atributo se lee
+    y escribe directamente en la columna correspondiente de la tabla. Las vistas
+    se crean al pedirlas y la tabla solo las recuerda mientras alguien las usa:
+    mientras una vista siga viva, el mismo paquete es el mismo objeto y también
+    se puede comparar con "is".
+    """
+    __slots__ = ('store', 'row', '__weakref__')
+
+    def __init__(self, package_id, pickup_location, delivery_location, store=None):
+        # Un paquete creado fuera del modelo vive en su propia tabla
+        if store is None:
+            store = PackageStore(capacity=1)
+        created = store.create(package_id, pickup_location, delivery_location)
+        self.store = created.store
+        self.row = created.row
+        store.views[self.row] = self  # Este objeto pasa a ser la vista de la fila
+
+    @classmethod
+    def view(cls, store, row):
+        """Vista sobre una fila existente, sin copiar datos"""
+        package = object.__new__(cls)
+        package.store = store
+        package.row = row
+        return package
+
+    def __eq__(self, other):
+        return isinstance(other, Package) and other.store is self.store and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    def __repr__(self):
+        return f"Package(id={self.id}, status={self.status!r})"
+
+    @property
+    def id(self):
+        return int(self.store.ids[self.row])
+
+    @property
+    def pickup_location(self):
+        """Posición de recogida (camión)"""
+        return tuple(self.store.pickup[self.row].tolist())
+
+    @property
+    def delivery_location(self):
+        """Posición de entrega (góndola)"""
+        return tuple(self.store.delivery[self.row].tolist())
+
+    @property
+    def status(self):
+        """waiting, assigned, picked o delivered"""
+        return PACKAGE_STATUSES[self.store.status[self.row]]
+
+    @status.setter
+    def status(self, new_status):
+        self.store.set_status(self.row, new_status)
+
+    assigned_robot_id = optional_column('robot')
+    assignment_time = optional_column('assignment_time')
+    pickup_time = optional_column('pickup_time')
+    delivery_time = optional_column('delivery_time')
+
+
+class PackageStore:
+    """Tabla columnar (struct of arrays) con todos los paquetes del modelo.
+
+    Cada atributo es una columna NumPy que crece duplicando su capacidad; un
+    Package es solo una vista con __slots__ sobre una fila que se crea al
+    consultarla, así que mientras nadie la use un paquete ocupa solo sus
+    columnas. Los tiempos y el robot asignado guardan -1 como "sin valor".
+
+    Los índices por estado se actualizan en cada transición: una cola FIFO de
+    filas en espera en otro array (cada fila guarda su hueco en la cola y lo pierde
+    al dejar de esperar, así que una fila devuelta vuelve siempre al final), conjuntos
+    para los estados con pocos paquetes (asignados y recogidos) y un contador
+    por estado. Los ids llegan en orden creciente, así que buscar por id es una
+    búsqueda binaria sobre su columna.
+    """
+    NONE = -1
+    STATUS_CODES = {status: code for code, status in enumerate(PACKAGE_STATUSES)}
+    WAITING = STATUS_CODES['waiting']
+    DELIVERED = STATUS_CODES['delivered']
+    # Columnas: nombre -> (dtype, forma de cada fila, valor inicial)
+    COLUMNS = {
+        'ids': (np.int32, (), 0),
+        'pickup': (np.int16, (2,), 0),
+        'delivery': (np.int16, (2,), 0),
+        'status': (np.int8, (), 0),
+        'queue_slot': (np.int32, (), NONE),  # Índice de su entrada vigente en la cola de espera
+        'robot': (np.int32, (), NONE),
+        'assignment_time': (np.int32, (), NONE),  # Pasos de simulación
+        'pickup_time': (np.int32, (), NONE),
+        'delivery_time': (np.int32, (), NONE),
+    }
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.capacity = max(1, capacity)
+        for name, (dtype, shape, fill) in self.COLUMNS.items():
+            setattr(self, name, np.full((self.capacity,) + shape, fill, dtype=dtype))
+        self.status_counts = [0] * len(PACKAGE_STATUSES)
+        # Cola de filas en espera por orden de llegada: array con cabeza y cola
+        self.waiting_queue = np.empty(self.capacity, dtype=np.int32)
+        self.queue_head = 0
+        self.queue_tail = 0
+        self.rows_by_status = {self.STATUS_CODES['assigned']: set(), self.STATUS_CODES['picked']: set()}
+        self.id_index = None  # id -> fila, solo si algún id llegó desordenado
+        self.views = WeakValueDictionary()  # fila -> vista Package, solo mientras siga en uso
+        self.changed_rows = None  # Filas creadas o con cambio de estado; solo tras track_changes()
+
+    def grow(self):
+        """Duplica la capacidad de todas las columnas"""
+        self.capacity *= 2
+        for name, (dtype, shape, fill) in self.COLUMNS.items():
+            column = np.full((self.capacity,) + shape, fill, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+
+    def create(self, package_id, pickup_location, delivery_location):
+        """Añade un paquete en espera y devuelve su vista"""
+        if self.size == self.capacity:
+            self.grow()
+        row = self.size
+        self.size += 1
+        if self.id_index is None and row and package_id <= self.ids[row - 1]:
+            self.id_index = {int(existing): index for index, existing in enumerate(self.ids[:row])}
+        if self.id_index is not None:
+            self.id_index[package_id] = row
+        self.ids[row] = package_id
+        self.pickup[row] = pickup_location
+        self.delivery[row] = delivery_location
+        self.status_counts[self.WAITING] += 1
+        self.enqueue(row)
+        if self.changed_rows is not None:
+            self.changed_rows.add(row)
+        return self.view(row)
+
+    def view(self, row):
+        """Vista Package de una fila; si ya hay una en uso devuelve esa misma"""
+        package = self.views.get(row)
+        if package is None:
+            package = Package.view(self, row)
+            self.views[row] = package
+        return package
+
+    def enqueue(self, row):
+        """Añade la fila al final de la cola de espera"""
+        if self.queue_tail == len(self.waiting_queue):
+            # Cola llena: compactar las entradas vigentes en un array del doble de tamaño
+            pending = self.waiting_queue[self.queue_head:self.queue_tail]
+            pending = pending[self.queue_slot[pending] == np.arange(self.queue_head, self.queue_tail)]
+            queue = np.empty(max(2 * len(pending), 16), dtype=np.int32)
+            queue[:len(pending)] = pending
+            self.queue_slot[pending] = np.arange(len(pending), dtype=np.int32)
+            self.waiting_queue, self.queue_head, self.queue_tail = queue, 0, len(pending)
+        self.waiting_queue[self.queue_tail] = row
+        self.queue_slot[row] = self.queue_tail
+        self.queue_tail += 1
+
+    def set_status(self, row, status):
+        """Cambia el estado de una fila y actualiza los índices"""
+        code = self.STATUS_CODES[status]
+        old_code = int(self.status[row])
+        if code == old_code:
+            return
+        self.status[row] = code
+        if self.changed_rows is not None:
+            self.changed_rows.add(row)
+        self.status_counts[old_code] -= 1
+        self.status_counts[code] += 1
+        if old_code in self.rows_by_status:
+            self.rows_by_status[old_code].discard(row)
+        if code in self.rows_by_status:
+            self.rows_by_status[code].add(row)
+        if code == self.WAITING:
+            self.enqueue(row)
+        else:
+            # Su entrada en la cola queda obsoleta: si vuelve a esperar irá al final
+            self.queue_slot[row] = self.NONE
+
+    def row_of(self, package_id):
+        if self.id_index is not None:
+            return self.id_index.get(package_id)
+        row = int(np.searchsorted(self.ids[:self.size], package_id))
+        return row if row < self.size and self.ids[row] == package_id else None
+
+    def get(self, package_id):
+        """Paquete con ese id, o None"""
+        row = self.row_of(package_id)
+        return None if row is None else self.view(row)
+
+    def waiting_rows(self, limit=None):
+        """Filas en espera en orden FIFO, descartando de la cabeza las entradas obsoletas"""
+        queue, slots = self.waiting_queue, self.queue_slot
+        while self.queue_head < self.queue_tail and slots[queue[self.queue_head]] != self.queue_head:
+            self.queue_head += 1
+        pending = queue[self.queue_head:self.queue_tail]
+        if limit is None:
+            return pending[slots[pending] == np.arange(self.queue_head, self.queue_tail)].tolist()
+        rows = []
+        for index in range(self.queue_head, self.queue_tail):
+            if len(rows) >= limit:
+                break
+            row = int(queue[index])
+            if slots[row] == index:
+                rows.append(row)
+        return rows
+
+    def with_status(self, status, limit=None):
+        """Paquetes en un estado (como mucho limit); los que esperan, del que más lleva al último"""
+        code = self.STATUS_CODES[status]
+        if code == self.WAITING:
+            rows = self.waiting_rows(limit)
+        elif code in self.rows_by_status:
+            rows = sorted(self.rows_by_status[code])[:limit]
+        else:
+            rows = np.flatnonzero(self.status[:self.size] == code)[:limit].tolist()
+        return [self.view(row) for row in rows]
+
+    def track_changes(self):
+        """Empieza a registrar las filas que cambian (quien lo activa debe vaciarlo con take_changes)"""
+        if self.changed_rows is None:
+            self.changed_rows = set()
+
+    def take_changes(self):
+        """Paquetes creados o con cambio de estado desde la última llamada; vacía el registro"""
+        if not self.changed_rows:
+            return []
+        rows = sorted(self.changed_rows)
+        self.changed_rows.clear()
+        return [self.view(row) for row in rows]
+
+    def count(self, status):
+        return self.status_counts[self.STATUS_CODES[status]]
+
+    def count_active(self):
+        """Paquetes aún no entregados"""
+        return self.size - self.status_counts[self.DELIVERED]
+
+    def active_packages(self):
+        """Paquetes aún no entregados, por orden de creación"""
+        rows = self.waiting_rows()
+        for indexed_rows in self.rows_by_status.values():
+            rows.extend(indexed_rows)
+        return [self.view(row) for row in sorted(rows)]
+
+    def delivery_stats(self):
+        """Estadísticas de tiempos (en pasos) de los paquetes entregados, como reducciones vectorizadas"""
+        size = self.size
+        delivered = self.status[:size] == self.DELIVERED
+        stats = {'delivered_in_store': int(delivered.sum())}  # No pisa el 'count' de quien las combine
+        assigned_at = self.assignment_time[:size]
+        picked_at = self.pickup_time[:size]
+        delivered_at = self.delivery_time[:size]
+        timed = delivered & (assigned_at >= 0) & (picked_at >= 0) & (delivered_at >= 0)
+        if timed.any():
+            assigned_at, picked_at, delivered_at = assigned_at[timed], picked_at[timed], delivered_at[timed]
+            pickup_to_delivery = delivered_at - picked_at
+            stats.update({
+                'avg_delivery_time': float(pickup_to_delivery.mean()),
+                'min_delivery_time': int(pickup_to_delivery.min()),
+                'max_delivery_time': int(pickup_to_delivery.max()),
+                'avg_pickup_to_delivery': float(pickup_to_delivery.mean()),
+                'avg_assignment_to_pickup': float((picked_at - assigned_at).mean()),
+                'avg_total_process': float((delivered_at - assigned_at).mean())
+            })
+        return stats
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (self.view(row) for row in range(self.size))
+
+
+class PackageRows:
+    """Lista de paquetes de una PackageStore guardada como filas (4 bytes por paquete).
+
+    Se usa como una lista de Package: las vistas se crean al recorrerla.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.rows = array('i')
+
+    def append(self, package):
+        self.rows.append(package.row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return (self.store.view(row) for row in self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.view(row) for row in self.rows[index]]
+        return self.store.view(self.rows[index])
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
 
 class ObstacleAgent(Agent):
     """Agente que representa un obstáculo en el grid"""
@@ -26,32 +345,130 @@ class ObstacleAgent(Agent):
 
 
 class ChargingStation:
-    """Representa una estación de carga (no es un agente)"""
+    """Representa una estación de carga (no es un agente).
+
+    La cola de espera es un diccionario ordenado robot_id -> turno: pertenencia,
+    alta y salida por la cabeza son O(1). Los turnos son números crecientes, así
+    que la posición de un robot es la distancia de su turno al de la cabeza menos
+    los turnos abandonados en medio, que se guardan en una lista ordenada: con k
+    abandonados pendientes, position_of es O(log k) y salir de en medio de la cola
+    O(k) (inserción en la lista). Cuando los abandonados superan a los robots que
+    esperan se renumeran los turnos, así que k nunca pasa del tamaño de la cola.
+
+    Cada robot que reserva turno guarda su llegada y su duración de carga
+    previstas; con ellas timeline() calcula cuándo empezaría y terminaría cada
+    turno de la cola, y por tanto cuánto esperaría un robot nuevo.
+    """
     def __init__(self, position, charging_rate=10):
         self.pos = position  # Posición en el grid
         self.charging_rate = charging_rate  # Tasa de carga por paso
-        self.waiting_queue = []  # Cola de robots esperando para cargar
+        self.waiting_queue = OrderedDict()  # Cola de robots esperando para cargar: robot_id -> turno
+        self.next_ticket = 0  # Turno que recibirá el próximo robot
+        self.removed_tickets = []  # Turnos abandonados detrás de la cabeza, ordenados
+        self.bookings = {}  # robot_id -> (paso de llegada previsto, pasos de carga previstos)
         self.current_robot = None  # Robot actualmente cargando
 
+    def charge_steps(self, deficit):
+        """Pasos de carga necesarios para recuperar deficit de batería"""
+        return max(0, math.ceil(deficit / self.charging_rate))
+
+    def book_slot(self, robot_id, arrival, charge_steps):
+        """Reserva turno al final de la cola con la llegada y la duración de carga previstas"""
+        added = self.add_to_queue(robot_id)
+        if robot_id in self.waiting_queue:
+            self.bookings[robot_id] = (arrival, charge_steps)
+        return added
+
+    def timeline(self, now, robots_by_id):
+        """Inicio y fin previstos (en pasos) de cada turno de la cola, en orden de servicio.
+
+        Los robots que siguen una ruta hacia la estación se estiman con su llegada
+        y su batería actuales, de modo que la previsión se corrige cuando cambia su
+        ruta; el resto usa su reserva (sin llegadas en el pasado). La carga en curso
+        y los turnos sin reserva se estiman con el déficit actual de cada robot.
+
+        Returns:
+            tuple: (lista de (robot_id, inicio, fin), paso en que la estación queda libre)
+        """
+        free_at = now
+        current = robots_by_id.get(self.current_robot)
+        if current is not None:
+            free_at += self.charge_steps(current.charge_deficit())
+        slots = []
+        for robot_id in self.waiting_queue:
+            robot = robots_by_id.get(robot_id)
+            booking = self.bookings.get(robot_id)
+            eta = robot.charging_eta(self) if robot is not None else None
+            if eta is not None:
+                arrival, steps = now + eta[0], eta[1]
+            elif booking is not None:
+                arrival, steps = max(now, booking[0]), booking[1]
+            else:
+                arrival, steps = now, (self.charge_steps(robot.charge_deficit()) if robot is not None else 0)
+            start = max(free_at, arrival)
+            free_at = start + steps
+            slots.append((robot_id, start, free_at))
+        return slots, free_at
+
+    def predicted_start(self, now, arrival, robots_by_id):
+        """Paso en que empezaría a cargar un robot que reserve ahora y llegue en arrival"""
+        return max(self.timeline(now, robots_by_id)[1], arrival)
+
+    def contains(self, robot_id):
+        """El robot está en la cola de espera"""
+        return robot_id in self.waiting_queue
+
+    def position_of(self, robot_id):
+        """Posición del robot en la cola (0 = el siguiente), o None si no está en ella (O(log k))"""
+        ticket = self.waiting_queue.get(robot_id)
+        if ticket is None:
+            return None
+        head = next(iter(self.waiting_queue.values()))
+        return ticket - head - bisect_left(self.removed_tickets, ticket)
+
+    def drop_from_queue(self, robot_id):
+        """Saca un robot de la cola; si no era la cabeza, su turno queda como abandonado (O(k))"""
+        ticket = self.waiting_queue.pop(robot_id)
+        if not self.waiting_queue:
+            self.removed_tickets.clear()
+            return
+        head = next(iter(self.waiting_queue.values()))
+        if ticket > head:
+            insort(self.removed_tickets, ticket)
+        else:
+            # Salió la cabeza: los abandonados anteriores a la nueva cabeza ya no cuentan
+            del self.removed_tickets[:bisect_left(self.removed_tickets, head)]
+        if len(self.removed_tickets) > len(self.waiting_queue):
+            self.renumber_tickets()
+
+    def renumber_tickets(self):
+        """Da turnos consecutivos a la cola y olvida los abandonados (O(n), amortizado por las bajas)"""
+        for ticket, robot_id in enumerate(list(self.waiting_queue)):
+            self.waiting_queue[robot_id] = ticket
+        self.next_ticket = len(self.waiting_queue)
+        self.removed_tickets.clear()
+
     def add_to_queue(self, robot_id):
         """Añade un robot a la cola de espera si no está ya"""
         if robot_id not in self.waiting_queue and robot_id != self.current_robot:
-            self.waiting_queue.append(robot_id)
-            print(f"Robot {robot_id} añadido a la cola de la estación en {self.pos}. Cola actual: {self.waiting_queue}")
+            self.waiting_queue[robot_id] = self.next_ticket
+            self.next_ticket += 1
+            print(f"Robot {robot_id} añadido a la cola de la estación en {self.pos}. Cola actual: {list(self.waiting_queue)}")
             return True
         return False
 
     def is_next_in_queue(self, robot_id):
         """Verifica si el robot es el siguiente en la cola"""
-        if self.current_robot is None and len(self.waiting_queue) > 0:
-            return self.waiting_queue[0] == robot_id
+        if self.current_robot is None and self.waiting_queue:
+            return next(iter(self.waiting_queue)) == robot_id
         return False
 
     def start_charging(self, robot_id):
         """Comienza a cargar un robot y lo elimina de la cola"""
         if self.current_robot is None:
             if robot_id in self.waiting_queue:
-                self.waiting_queue.remove(robot_id)
+                self.drop_from_queue(robot_id)
+            self.bookings.pop(robot_id, None)
             self.current_robot = robot_id
             print(f"Robot {robot_id} comienza a cargar en la estación {self.pos}")
             return True
@@ -68,11 +485,1350 @@ class ChargingStation:
     def remove_from_queue(self, robot_id):
         """Elimina un robot de la cola (si cancela su carga)"""
         if robot_id in self.waiting_queue:
-            self.waiting_queue.remove(robot_id)
+            self.drop_from_queue(robot_id)
+            self.bookings.pop(robot_id, None)
             print(f"Robot {robot_id} eliminado de la cola de la estación {self.pos}")
             return True
         return False
 
+# Movimientos cardinales permitidos en el grid (izquierda, derecha, arriba, abajo)
+MOVES = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+
+# Carriles de sentido único: cada celda guarda una máscara con los movimientos de salida
+# permitidos (bit i = MOVES[i]); 0 significa celda sin restricción.
+# Cada entrada es (dx, dy, bit del movimiento, bit del movimiento opuesto)
+LANE_MOVES = [(-1, 0, 1, 2), (1, 0, 2, 1), (0, 1, 4, 8), (0, -1, 8, 4)]
+
+
+def manhattan(a, b):
+    """Distancia Manhattan entre dos celdas"""
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+def remove_path_loops(path):
+    """Elimina ciclos de una ruta: si una celda se repite, se salta el tramo intermedio"""
+    result = []
+    seen = {}
+    for pos in path:
+        if pos in seen:
+            cut = seen[pos]
+            for removed in result[cut + 1:]:
+                del seen[removed]
+            del result[cut + 1:]
+        else:
+            seen[pos] = len(result)
+            result.append(pos)
+    return result
+
+
+class RobotPath:
+    """Ruta de un robot guardada como array de celdas empaquetadas (x * height + y) y un cursor.
+
+    Avanzar con pop(0) solo mueve el cursor (el array se compacta de vez en
+    cuando), y la ruta se serializa como lista plana de enteros. Mantiene la
+    interfaz de lista que usa el resto del código: índices y cortes, len,
+    iteración, pertenencia, comparación con listas, concatenación, extend y copy.
+
+    Cada ruta lleva además un hash polinómico de sus celdas que se actualiza en
+    O(1) al avanzar o al añadir celdas por los extremos, de modo que fingerprint()
+    identifica la ruta restante sin recorrerla.
+    """
+    HASH_MODULUS = (1 << 61) - 1
+    HASH_BASE = 1000003
+    HASH_BASE_INVERSE = pow(HASH_BASE, HASH_MODULUS - 2, HASH_MODULUS)
+
+    def __init__(self, positions=(), height=1):
+        self.height = height
+        self.cursor = 0  # Índice en cells de la posición actual
+        if isinstance(positions, RobotPath) and positions.height == height:
+            self.cells = positions.cells[positions.cursor:]
+            self.hash_value = positions.hash_value
+            self.top_power = positions.top_power
+        else:
+            self.cells = array('i', [x * height + y for x, y in positions])
+            self.rehash()
+
+    def rehash(self):
+        """Recalcula el hash: suma de celda_i * BASE^(n-1-i); top_power guarda BASE^(n-1)"""
+        modulus, base = self.HASH_MODULUS, self.HASH_BASE
+        hash_value = 0
+        top_power = self.HASH_BASE_INVERSE  # BASE^-1 para la ruta vacía
+        for cell in self.cells[self.cursor:]:
+            hash_value = (hash_value * base + cell) % modulus
+            top_power = top_power * base % modulus
+        self.hash_value = hash_value
+        self.top_power = top_power
+
+    def fingerprint(self):
+        """Identificador de la ruta restante (longitud y hash), comparable en O(1)"""
+        return (len(self), self.hash_value)
+
+    @classmethod
+    def from_parents(cls, came_from, last, height):
+        """Ruta que acaba en last siguiendo came_from hacia atrás.
+
+        Mide primero la cadena y escribe las celdas empaquetadas de atrás hacia
+        delante en un array ya reservado, sin lista intermedia ni inversión.
+        """
+        length = 1
+        node = last
+        while node in came_from:
+            node = came_from[node]
+            length += 1
+        cells = array('i', [0]) * length
+        node = last
+        for index in range(length - 1, -1, -1):
+            cells[index] = node[0] * height + node[1]
+            node = came_from.get(node)
+        path = cls(height=height)
+        path.cells = cells
+        path.rehash()
+        return path
+
+    def pack(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def __len__(self):
+        return len(self.cells) - self.cursor
+
+    def __iter__(self):
+        height = self.height
+        for cell in self.cells[self.cursor:]:
+            yield divmod(cell, height)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            height = self.height
+            return [divmod(cell, height) for cell in self.cells[self.cursor:][index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("índice fuera de la ruta")
+        return divmod(self.cells[self.cursor + index], self.height)
+
+    def __contains__(self, pos):
+        return self.pack(pos) in self.cells[self.cursor:]
+
+    def index(self, pos):
+        """Posición de pos en la ruta, o ValueError si no está"""
+        try:
+            return self.cells.index(self.pack(pos), self.cursor) - self.cursor
+        except ValueError:
+            raise ValueError(f"{pos} no está en la ruta") from None
+
+    def __eq__(self, other):
+        if isinstance(other, RobotPath) and other.height == self.height:
+            return self.cells[self.cursor:] == other.cells[other.cursor:]
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def pop(self, index=-1):
+        if index == 0:
+            pos = self[0]
+            modulus = self.HASH_MODULUS
+            self.hash_value = (self.hash_value - self.cells[self.cursor] * self.top_power) % modulus
+            self.top_power = self.top_power * self.HASH_BASE_INVERSE % modulus
+            self.cursor += 1
+            # Compactar cuando la mitad del array ya está recorrida: O(1) amortizado
+            if self.cursor >= 32 and self.cursor * 2 >= len(self.cells):
+                del self.cells[:self.cursor]
+                self.cursor = 0
+            return pos
+        pos = self[index]
+        del self.cells[self.cursor + (index if index >= 0 else index + len(self))]
+        self.rehash()
+        return pos
+
+    def append(self, pos):
+        cell = self.pack(pos)
+        self.cells.append(cell)
+        modulus, base = self.HASH_MODULUS, self.HASH_BASE
+        self.hash_value = (self.hash_value * base + cell) % modulus
+        self.top_power = self.top_power * base % modulus
+
+    def extend(self, positions):
+        for pos in positions:
+            self.append(pos)
+
+    def insert(self, index, pos):
+        if index != 0:
+            self.cells.insert(self.cursor + index, self.pack(pos))
+            self.rehash()
+            return
+        cell = self.pack(pos)
+        if self.cursor > 0:
+            self.cursor -= 1
+            self.cells[self.cursor] = cell
+        else:
+            self.cells.insert(0, cell)
+        modulus, base = self.HASH_MODULUS, self.HASH_BASE
+        self.top_power = self.top_power * base % modulus
+        self.hash_value = (self.hash_value + cell * self.top_power) % modulus
+
+    def copy(self):
+        return RobotPath(self, self.height)
+
+    def to_flat(self):
+        """Serialización compacta: [x0, y0, x1, y1, ...]"""
+        flat = []
+        height = self.height
+        for cell in self.cells[self.cursor:]:
+            flat.extend(divmod(cell, height))
+        return flat
+
+
+def wavefront_distances(blocked_map, width, height, source, lane_map=None, toward_source=False):
+    """Distancias BFS desde source a todas las celdas en una pasada vectorizada.
+
+    El frente de onda avanza desplazando una máscara booleana en las cuatro
+    direcciones. Devuelve una matriz width x height con -1 en las celdas
+    inalcanzables, de modo que cada consulta posterior es un acceso al array.
+    Con mapa de carriles, cada dirección solo avanza desde las celdas que la permiten.
+    Con toward_source las distancias son de cada celda hasta source: el frente
+    recorre los movimientos al revés, como DistanceField.
+    """
+    free = np.frombuffer(blocked_map, dtype=np.uint8).reshape(width, height) == 0
+    exits = None
+    if lane_map is not None:
+        masks = np.frombuffer(lane_map, dtype=np.uint8).reshape(width, height)
+        exits = [(masks == 0) | ((masks & bit) != 0) for _, _, bit, _ in LANE_MOVES]
+    distances = np.full((width, height), -1, dtype=np.int32)
+    x, y = source
+    if not (0 <= x < width and 0 <= y < height):
+        return distances
+    frontier = np.zeros((width, height), dtype=bool)
+    frontier[x, y] = True
+    distances[x, y] = 0
+    step = 0
+    while frontier.any():
+        step += 1
+        expanded = np.zeros_like(frontier)
+        if exits is not None and toward_source:
+            # Entra en el frente la celda que llega a él con un movimiento que su carril permite
+            left, right, up, down = exits
+            expanded[1:, :] |= frontier[:-1, :] & left[1:, :]
+            expanded[:-1, :] |= frontier[1:, :] & right[:-1, :]
+            expanded[:, :-1] |= frontier[:, 1:] & up[:, :-1]
+            expanded[:, 1:] |= frontier[:, :-1] & down[:, 1:]
+        else:
+            if exits is None:
+                left = right = up = down = frontier
+            else:
+                left, right, up, down = (frontier & allowed for allowed in exits)
+            expanded[:-1, :] |= left[1:, :]
+            expanded[1:, :] |= right[:-1, :]
+            expanded[:, 1:] |= up[:, :-1]
+            expanded[:, :-1] |= down[:, 1:]
+        frontier = expanded & free & (distances < 0)
+        distances[frontier] = step
+    return distances
+
+
+class SearchBudget:
+    """Presupuesto de expansiones y de tiempo compartido por una serie de búsquedas.
+
+    Cuando se agota, las búsquedas A* que lo usan devuelven la mejor ruta parcial
+    encontrada hasta ese momento, así que el coste de una replanificación queda
+    acotado aunque encadene varias estrategias.
+    """
+    def __init__(self, max_expansions=None, time_budget=None):
+        self.max_expansions = max_expansions
+        self.deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        self.expansions = 0
+        self.exhausted = False
+
+    def spend(self):
+        """Cuenta una expansión; devuelve False si el presupuesto ya está agotado"""
+        if self.exhausted:
+            return False
+        self.expansions += 1
+        if self.max_expansions is not None and self.expansions > self.max_expansions:
+            self.exhausted = True
+        # El reloj solo se consulta cada 64 expansiones
+        elif self.deadline is not None and self.expansions % 64 == 0 and time.perf_counter() > self.deadline:
+            self.exhausted = True
+        return not self.exhausted
+
+
+class AStarSearch:
+    """Motor A* reutilizable sobre el grid 4-conexo.
+
+    La frontera es un heap binario con borrado perezoso (las entradas obsoletas
+    se descartan al extraerlas) y los nodos expandidos van a un conjunto cerrado.
+    Los empates en f se resuelven por orden de primera inserción, igual que el
+    antiguo min() sobre una lista, así que las rutas son deterministas.
+    Cada planificador se configura con sus propias funciones de paso y costo;
+    los obstáculos estáticos se leen directamente del mapa de bits del modelo.
+    Con un SearchBudget la búsqueda es "anytime": si se agota el presupuesto
+    devuelve la ruta hasta el nodo expandido más cercano a la meta.
+    Con un mapa de carriles solo se generan los movimientos que permite cada celda.
+    """
+    def __init__(self, width, height, blocked_map, is_passable=None, move_cost=None, heuristic=manhattan,
+                 budget=None, lane_map=None):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map  # bytearray con 1 en las celdas con obstáculo (x * height + y)
+        self.is_passable = is_passable  # función(pos) -> bool: restricciones extra (None = ninguna)
+        self.move_cost = move_cost  # función(pos) -> costo de entrar en la celda (None = 1)
+        self.heuristic = heuristic  # función(pos, goal) -> estimación admisible
+        self.budget = budget  # SearchBudget compartido (None = sin límite)
+        self.lane_map = lane_map  # bytearray de máscaras de carril (None = sin carriles)
+        self.nodes_expanded = 0  # Estadística de la última búsqueda
+        self.partial = False  # La última ruta se cortó por falta de presupuesto
+
+    def search(self, start, goal):
+        """Devuelve la ruta de start a goal (ambos incluidos) como RobotPath, o [] si no existe"""
+        width, height = self.width, self.height
+        blocked_map = self.blocked_map
+        is_passable = self.is_passable
+        move_cost = self.move_cost
+        heuristic = self.heuristic
+        budget = self.budget
+        lane_map = self.lane_map
+
+        came_from = {}
+        g_score = {start: 0}
+        insertion_order = {start: 0}
+        closed = set()
+        open_heap = [(heuristic(start, goal), 0, start)]
+        self.nodes_expanded = 0
+        self.partial = False
+        best = None  # (h, g, nodo) del nodo expandido más cercano a la meta
+
+        while open_heap:
+            _, _, current = heapq.heappop(open_heap)
+            if current in closed:
+                continue  # Entrada obsoleta (borrado perezoso)
+            if current == goal:
+                return RobotPath.from_parents(came_from, current, height)
+            if budget is not None:
+                if not budget.spend():
+                    # Presupuesto agotado: ruta parcial hacia la meta
+                    self.partial = True
+                    return RobotPath.from_parents(came_from, best[2] if best is not None else start, height)
+                candidate = (heuristic(current, goal), g_score[current], current)
+                if best is None or candidate[:2] < best[:2]:
+                    best = candidate
+
+            closed.add(current)
+            self.nodes_expanded += 1
+            current_g = g_score[current]
+            lanes = lane_map[current[0] * height + current[1]] if lane_map is not None else 0
+
+            for dx, dy, bit, _ in LANE_MOVES:
+                if lanes and not lanes & bit:
+                    continue  # El carril no permite salir en esta dirección
+                nx, ny = current[0] + dx, current[1] + dy
+                if not (0 <= nx < width and 0 <= ny < height) or blocked_map[nx * height + ny]:
+                    continue
+                neighbor = (nx, ny)
+                if neighbor in closed or (is_passable is not None and not is_passable(neighbor)):
+                    continue
+
+                tentative_g_score = current_g + (1 if move_cost is None else move_cost(neighbor))
+                if tentative_g_score < g_score.get(neighbor, float('inf')):
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    order = insertion_order.setdefault(neighbor, len(insertion_order))
+                    heapq.heappush(open_heap, (tentative_g_score + heuristic(neighbor, goal), order, neighbor))
+        return []
+
+class BidirectionalSearch:
+    """BFS bidireccional frente a frente para búsquedas de coste unitario.
+
+    Expande por capas completas el frente más pequeño. Al terminar la primera capa
+    en la que se tocan los dos árboles se elige el encuentro con menor suma de
+    profundidades, así que la ruta mide lo mismo que la de A*. En rutas largas
+    sin campo de distancias explora dos rombos pequeños en lugar de un cono
+    completo hasta la meta.
+    """
+    def __init__(self, width, height, blocked_map, is_passable=None):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.is_passable = is_passable  # función(pos) -> bool para las celdas en las que se entra
+        self.nodes_expanded = 0
+
+    def can_enter(self, pos):
+        x, y = pos
+        if not (0 <= x < self.width and 0 <= y < self.height) or self.blocked_map[x * self.height + y]:
+            return False
+        return self.is_passable is None or self.is_passable(pos)
+
+    def search(self, start, goal):
+        """Devuelve la ruta de start a goal (ambos incluidos) o [] si no existe"""
+        self.nodes_expanded = 0
+        if start == goal:
+            return [start]
+        if not self.can_enter(goal):
+            return []
+
+        # Profundidad y padre de cada celda alcanzada desde cada extremo
+        forward = {start: (0, None)}
+        backward = {goal: (0, None)}
+        forward_frontier = [start]
+        backward_frontier = [goal]
+        while forward_frontier and backward_frontier:
+            if len(forward_frontier) <= len(backward_frontier):
+                forward_frontier, meeting = self.expand_layer(forward_frontier, forward, backward, None)
+            else:
+                # Hacia atrás se recorre el movimiento al revés: la celda nueva es la de origen
+                backward_frontier, meeting = self.expand_layer(backward_frontier, backward, forward, start)
+            if meeting is not None:
+                return self.join(meeting, forward, backward)
+        return []
+
+    def expand_layer(self, frontier, visited, other_visited, start):
+        """Expande una capa completa; devuelve la capa siguiente y el mejor encuentro"""
+        next_frontier = []
+        best = None
+        for pos in frontier:
+            self.nodes_expanded += 1
+            depth = visited[pos][0] + 1
+            for dx, dy in MOVES:
+                neighbor = (pos[0] + dx, pos[1] + dy)
+                if neighbor in visited:
+                    continue
+                # El inicio no se comprueba (el robot ya está en él), igual que en A*
+                if neighbor != start and not self.can_enter(neighbor):
+                    continue
+                visited[neighbor] = (depth, pos)
+                next_frontier.append(neighbor)
+                if neighbor in other_visited:
+                    cost = depth + other_visited[neighbor][0]
+                    if best is None or cost < best[0]:
+                        best = (cost, neighbor)
+        return next_frontier, (best[1] if best is not None else None)
+
+    @staticmethod
+    def join(meeting, forward, backward):
+        path = []
+        node = meeting
+        while node is not None:
+            path.append(node)
+            node = forward[node][1]
+        path.reverse()
+        node = backward[meeting][1]
+        while node is not None:
+            path.append(node)
+            node = backward[node][1]
+        return path
+
+class DistanceField:
+    """Campo de distancias BFS hacia un destino fijo sobre el mapa de obstáculos.
+
+    Guarda la distancia real (en pasos, ignorando robots) de cada celda al
+    destino; la ruta desde cualquier celda se obtiene siguiendo el gradiente
+    en O(longitud de la ruta). Al bloquearse una celda solo se recalculan las
+    celdas cuya distancia dependía de ella. Con mapa de carriles el BFS recorre
+    los movimientos al revés: una celda hereda distancia de un vecino solo si
+    su carril le permite salir hacia él.
+    """
+    UNREACHABLE = -1
+
+    def __init__(self, target, width, height, blocked_map, lane_map=None):
+        self.target = target
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.lane_map = lane_map  # bytearray de máscaras de carril (None = sin carriles)
+        self.distances = array('i', [self.UNREACHABLE]) * (width * height)
+        self.build()
+
+    def build(self):
+        """BFS completo desde el destino"""
+        width, height = self.width, self.height
+        distances = self.distances
+        for i in range(len(distances)):
+            distances[i] = self.UNREACHABLE
+
+        tx, ty = self.target
+        if not (0 <= tx < width and 0 <= ty < height) or self.blocked_map[tx * height + ty]:
+            return
+        distances[tx * height + ty] = 0
+        lane_map = self.lane_map
+        queue = deque([self.target])
+        while queue:
+            x, y = queue.popleft()
+            next_distance = distances[x * height + y] + 1
+            for dx, dy, _, opposite in LANE_MOVES:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    index = nx * height + ny
+                    # El vecino llega a (x, y) con el movimiento opuesto a (dx, dy)
+                    if lane_map is not None and lane_map[index] and not lane_map[index] & opposite:
+                        continue
+                    if distances[index] == self.UNREACHABLE and not self.blocked_map[index]:
+                        distances[index] = next_distance
+                        queue.append((nx, ny))
+
+    def can_leave(self, x, y, bit):
+        """El carril de (x, y) permite salir con el movimiento bit"""
+        if self.lane_map is None:
+            return True
+        lanes = self.lane_map[x * self.height + y]
+        return not lanes or bool(lanes & bit)
+
+    def distance(self, pos):
+        """Distancia real al destino, o None si es inalcanzable"""
+        x, y = pos
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        value = self.distances[x * self.height + y]
+        return None if value == self.UNREACHABLE else value
+
+    def heuristic(self, pos, goal):
+        """Heurística exacta (sin robots) para A* hacia el destino del campo"""
+        value = self.distances[pos[0] * self.height + pos[1]]
+        return float('inf') if value == self.UNREACHABLE else value
+
+    def path_from(self, start):
+        """Sigue el gradiente desde start hasta el destino; [] si es inalcanzable"""
+        height = self.height
+        distances = self.distances
+        current_distance = self.distance(start)
+        if current_distance is None:
+            return []
+
+        path = [start]
+        x, y = start
+        while current_distance > 0:
+            for dx, dy, bit, _ in LANE_MOVES:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < self.width and 0 <= ny < height and distances[nx * height + ny] == current_distance - 1 \
+                        and self.can_leave(x, y, bit):
+                    x, y = nx, ny
+                    break
+            current_distance -= 1
+            path.append((x, y))
+        return path
+
+    def next_step(self, pos, is_free=None):
+        """Siguiente celda del campo de flujo: un vecino a distancia d-1, libre si es posible.
+
+        Devuelve None en el destino o si pos no puede llegar a él.
+        """
+        current_distance = self.distance(pos)
+        if not current_distance:
+            return None
+        fallback = None
+        x, y = pos
+        for dx, dy, bit, _ in LANE_MOVES:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height and \
+                    self.distances[nx * self.height + ny] == current_distance - 1 and self.can_leave(x, y, bit):
+                if is_free is None or is_free((nx, ny)):
+                    return (nx, ny)
+                if fallback is None:
+                    fallback = (nx, ny)  # Todos los descensos ocupados: esperar tras el primero
+        return fallback
+
+    def block_cell(self, pos):
+        """Actualiza el campo tras añadirse un obstáculo en pos.
+
+        Solo se invalidan las celdas que se quedan sin ningún vecino a distancia
+        d-1 y se reparan desde el borde válido de esa región.
+        """
+        width, height = self.width, self.height
+        distances = self.distances
+        x, y = pos
+        index = x * height + y
+        old_distance = distances[index]
+        if old_distance == self.UNREACHABLE:
+            return  # La celda no formaba parte de ninguna ruta hacia el destino
+        if pos == self.target or self.lane_map is not None:
+            # La reparación local supone vecindad simétrica; con carriles se recalcula entero
+            self.build()
+            return
+        distances[index] = self.UNREACHABLE
+
+        # 1. Invalidar en orden de distancia las celdas que dependían de pos
+        invalid = set()
+        queue = deque()
+        for dx, dy in MOVES:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height and distances[nx * height + ny] == old_distance + 1:
+                queue.append((nx, ny))
+        while queue:
+            cx, cy = queue.popleft()
+            if (cx, cy) in invalid:
+                continue
+            cell_distance = distances[cx * height + cy]
+            supported = False
+            children = []
+            for dx, dy in MOVES:
+                nx, ny = cx + dx, cy + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    neighbor_distance = distances[nx * height + ny]
+                    if neighbor_distance == cell_distance - 1 and (nx, ny) not in invalid:
+                        supported = True
+                        break
+                    if neighbor_distance == cell_distance + 1:
+                        children.append((nx, ny))
+            if not supported:
+                invalid.add((cx, cy))
+                queue.extend(children)
+
+        # 2. Reparar la región invalidada desde su borde válido
+        for cx, cy in invalid:
+            distances[cx * height + cy] = self.UNREACHABLE
+        frontier = []
+        for cx, cy in invalid:
+            best = None
+            for dx, dy in MOVES:
+                nx, ny = cx + dx, cy + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    neighbor_distance = distances[nx * height + ny]
+                    if neighbor_distance != self.UNREACHABLE and (best is None or neighbor_distance + 1 < best):
+                        best = neighbor_distance + 1
+            if best is not None:
+                heapq.heappush(frontier, (best, cx, cy))
+        while frontier:
+            cell_distance, cx, cy = heapq.heappop(frontier)
+            cell_index = cx * height + cy
+            if distances[cell_index] != self.UNREACHABLE:
+                continue
+            distances[cell_index] = cell_distance
+            for dx, dy in MOVES:
+                nx, ny = cx + dx, cy + dy
+                if (nx, ny) in invalid and distances[nx * height + ny] == self.UNREACHABLE:
+                    heapq.heappush(frontier, (cell_distance + 1, nx, ny))
+
+class LandmarkHeuristic:
+    """Heurística ALT (A*, landmarks y desigualdad triangular) sobre el mapa de obstáculos.
+
+    Guarda campos de distancias desde unos pocos landmarks elegidos por punto más
+    lejano. Para cualquier par de celdas |d(L, meta) - d(L, celda)| es una cota
+    inferior de la distancia real, también con costes extra por robots, así que
+    la heurística sigue siendo admisible en las búsquedas con penalización y está
+    mucho mejor informada que Manhattan alrededor de las estanterías. Los campos
+    se reparan con cada obstáculo nuevo y los landmarks se eligen bajo demanda.
+    """
+    def __init__(self, width, height, blocked_map, count=4):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.count = count
+        self.fields = []  # Un DistanceField por landmark
+        self.stale = True  # Los landmarks se eligen en la próxima consulta
+
+    def select_landmarks(self):
+        """Elige los landmarks por punto más lejano a partir de una celda libre cualquiera"""
+        self.fields = []
+        self.stale = False
+        free_index = self.blocked_map.find(0)
+        if free_index < 0:
+            return
+        seed = DistanceField(divmod(free_index, self.height), self.width, self.height, self.blocked_map)
+        closest = list(seed.distances)
+        for _ in range(self.count):
+            farthest = max(range(len(closest)), key=closest.__getitem__)
+            if closest[farthest] <= 0:
+                break  # No quedan celdas alejadas de los landmarks ya elegidos
+            field = DistanceField(divmod(farthest, self.height), self.width, self.height, self.blocked_map)
+            if not self.fields:
+                closest = list(field.distances)
+            else:
+                closest = [min(current, distance) for current, distance in zip(closest, field.distances)]
+            self.fields.append(field)
+
+    def block_cell(self, pos):
+        """Actualiza los campos tras añadirse un obstáculo en pos"""
+        if self.stale:
+            return
+        if any(field.target == pos for field in self.fields):
+            self.stale = True  # Un landmark quedó bloqueado: volver a elegirlos
+            return
+        for field in self.fields:
+            field.block_cell(pos)
+
+    def heuristic(self, pos, goal):
+        if self.stale:
+            self.select_landmarks()
+        best = manhattan(pos, goal)
+        pos_index = pos[0] * self.height + pos[1]
+        goal_index = goal[0] * self.height + goal[1]
+        for field in self.fields:
+            pos_distance = field.distances[pos_index]
+            goal_distance = field.distances[goal_index]
+            if pos_distance < 0 or goal_distance < 0:
+                if (pos_distance < 0) != (goal_distance < 0):
+                    return float('inf')  # Componentes distintas: la meta es inalcanzable
+                continue
+            difference = abs(goal_distance - pos_distance)
+            if difference > best:
+                best = difference
+        return best
+
+class CongestionMap:
+    """Mapa de calor de congestión por celda con decaimiento exponencial.
+
+    Cada bloqueo o paso sin avanzar suma calor en la celda. El decaimiento es
+    perezoso: el valor real es heat * scale y cada paso solo multiplica scale,
+    así que actualizar el mapa cuesta O(robots) por paso. La matriz se
+    renormaliza cuando scale se hace muy pequeña.
+    """
+    def __init__(self, width, height, decay=0.98):
+        self.heat = np.zeros((width, height))
+        self.decay = decay
+        self.scale = 1.0
+
+    def tick(self):
+        """Aplica el decaimiento de un paso"""
+        self.scale *= self.decay
+        if self.scale < 1e-6:
+            self.heat *= self.scale
+            self.scale = 1.0
+
+    def record(self, pos, amount=1.0):
+        self.heat[pos[0], pos[1]] += amount / self.scale
+
+    def value(self, pos):
+        return self.heat[pos[0], pos[1]] * self.scale
+
+class ReservationTable:
+    """Tabla de reservas espacio-temporales compartida por los robots.
+
+    Cada entrada (celda, paso) pertenece a un robot. Quien ocupa una celda en el
+    paso t la reserva también en t + 1, así nadie entra en una celda que se está
+    desocupando en el mismo paso; esto evita intercambios y que el orden de
+    ejecución del scheduler provoque bloqueos.
+    """
+    def __init__(self):
+        self.reservations = {}  # (pos, t) -> robot_id
+
+    def clear(self):
+        self.reservations.clear()
+
+    def is_reserved(self, pos, t, robot_id):
+        """True si la celda está reservada por otro robot en el paso t"""
+        owner = self.reservations.get((pos, t))
+        return owner is not None and owner != robot_id
+
+    def reserve_path(self, path, robot_id, until):
+        """Reserva una ruta espacio-temporal y la última celda hasta el paso until"""
+        for t, pos in enumerate(path):
+            self.reservations[(pos, t)] = robot_id
+            self.reservations[(pos, t + 1)] = robot_id
+        last = path[-1]
+        for t in range(len(path), until + 1):
+            self.reservations[(last, t)] = robot_id
+
+
+class CooperativePlanner:
+    """A* cooperativo con ventana (WHCA*) sobre la tabla de reservas.
+
+    Busca en el espacio (celda, paso) con movimientos cardinales y esperas, solo
+    durante `window` pasos; más allá de la ventana la heurística de distancia
+    estima el resto del camino. El plan encontrado se reserva para los robots
+    que se planifican después.
+    """
+    def __init__(self, width, height, blocked_map, reservations, window=8):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.reservations = reservations
+        self.window = window
+        self.lane_map = None  # Máscaras de carril del modelo, si las hay
+
+    def plan(self, robot_id, start, goal, heuristic=manhattan):
+        """Devuelve la ruta de la ventana (con esperas repetidas) o [] si no hay ninguna"""
+        width, height = self.width, self.height
+        window = self.window
+        reservations = self.reservations
+
+        came_from = {}
+        closed = set()
+        counter = 0
+        start_state = (start, 0)
+        open_heap = [(heuristic(start, goal), counter, start_state)]
+
+        while open_heap:
+            f, _, state = heapq.heappop(open_heap)
+            if state in closed:
+                continue
+            closed.add(state)
+            pos, t = state
+
+            # Meta alcanzada y libre hasta el final de la ventana, o ventana agotada
+            if t == window or (pos == goal and not any(
+                    reservations.is_reserved(goal, later, robot_id) for later in range(t, window + 1))):
+                path = [pos]
+                while state in came_from:
+                    state = came_from[state]
+                    path.append(state[0])
+                path.reverse()
+                return path
+
+            lanes = self.lane_map[pos[0] * height + pos[1]] if self.lane_map is not None else 0
+            for dx, dy, bit, _ in LANE_MOVES + [(0, 0, 0, 0)]:
+                if lanes and bit and not lanes & bit:
+                    continue  # Esperar siempre está permitido; moverse, solo en el sentido del carril
+                nx, ny = pos[0] + dx, pos[1] + dy
+                if not (0 <= nx < width and 0 <= ny < height) or self.blocked_map[nx * height + ny]:
+                    continue
+                next_state = ((nx, ny), t + 1)
+                if next_state in closed or reservations.is_reserved((nx, ny), t + 1, robot_id):
+                    continue
+                if next_state not in came_from:
+                    came_from[next_state] = state
+                    counter += 1
+                    heapq.heappush(open_heap, (t + 1 + heuristic((nx, ny), goal), counter, next_state))
+        return []
+
+class ConflictBasedSearch:
+    """Conflict-Based Search (CBS) para planificar varios robots a la vez.
+
+    El nivel alto explora un árbol de restricciones: detecta el primer conflicto
+    (misma celda en el mismo paso, o intercambio de celdas) entre las rutas y
+    ramifica prohibiéndoselo a cada uno de los dos robots. El nivel bajo es un
+    A* espacio-temporal que respeta esas restricciones. Cada robot se queda en
+    su meta al terminar, así que dos robots con la misma meta no tienen
+    solución: solve() lo detecta antes de buscar. Si no hay solución o se agota
+    el presupuesto de nodos o de tiempo, solve() devuelve None y deja el motivo
+    en failure.
+    """
+    def __init__(self, width, height, blocked_map, extra_blocked=(), max_nodes=200, time_budget=0.05,
+                 lane_map=None):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.lane_map = lane_map  # Máscaras de carril (None = sin carriles)
+        self.extra_blocked = set(extra_blocked)  # Celdas ocupadas por robots detenidos
+        self.max_nodes = max_nodes
+        self.time_budget = time_budget  # Segundos, sin contar la planificación de la raíz
+        self.nodes_expanded = 0
+        self.failure = None  # Motivo por el que la última llamada a solve() devolvió None
+
+    def solve(self, agents):
+        """
+        Args:
+            agents: dict robot_id -> (start, goal, heuristic)
+        Returns:
+            dict robot_id -> ruta sin conflictos (con esperas repetidas), o None
+        """
+        self.nodes_expanded = 0
+        self.failure = None
+        goals = [goal for _, goal, _ in agents.values()]
+        if len(set(goals)) < len(goals):
+            self.failure = "varios robots comparten meta"
+            return None
+        constraints = {robot_id: frozenset() for robot_id in agents}
+        paths = {}
+        for robot_id, (start, goal, heuristic) in agents.items():
+            path = self.plan_single(start, goal, heuristic, constraints[robot_id])
+            if not path:
+                self.failure = f"el robot {robot_id} no tiene ruta a su meta"
+                return None
+            paths[robot_id] = path
+
+        deadline = time.perf_counter() + self.time_budget
+        counter = 0
+        open_heap = [(self.solution_cost(paths), counter, constraints, paths)]
+        while open_heap:
+            if self.nodes_expanded >= self.max_nodes:
+                self.failure = f"presupuesto de nodos agotado tras {self.nodes_expanded} nodos"
+                return None
+            if time.perf_counter() > deadline:
+                self.failure = f"presupuesto de tiempo agotado tras {self.nodes_expanded} nodos"
+                return None
+            _, _, constraints, paths = heapq.heappop(open_heap)
+            self.nodes_expanded += 1
+
+            conflict = self.find_conflict(paths)
+            if conflict is None:
+                return paths
+
+            for robot_id, constraint in conflict:
+                child_constraints = dict(constraints)
+                child_constraints[robot_id] = constraints[robot_id] | {constraint}
+                start, goal, heuristic = agents[robot_id]
+                path = self.plan_single(start, goal, heuristic, child_constraints[robot_id])
+                if not path:
+                    continue
+                child_paths = dict(paths)
+                child_paths[robot_id] = path
+                counter += 1
+                heapq.heappush(open_heap, (self.solution_cost(child_paths), counter, child_constraints, child_paths))
+        self.failure = f"no hay rutas sin conflictos ({self.nodes_expanded} nodos)"
+        return None
+
+    @staticmethod
+    def solution_cost(paths):
+        return sum(len(path) - 1 for path in paths.values())
+
+    @staticmethod
+    def find_conflict(paths):
+        """Primer conflicto como [(robot_id, restricción), (robot_id, restricción)] o None.
+
+        Las restricciones son (pos, t) para celdas y (origen, destino, t) para movimientos.
+        Cada robot permanece en su meta después de terminar su ruta.
+        """
+        robot_ids = sorted(paths)
+        horizon = max(len(path) for path in paths.values())
+        for t in range(horizon):
+            occupied = {}
+            for robot_id in robot_ids:
+                path = paths[robot_id]
+                pos = path[min(t, len(path) - 1)]
+                if pos in occupied:
+                    return [(occupied[pos], (pos, t)), (robot_id, (pos, t))]
+                occupied[pos] = robot_id
+            if t == 0:
+                continue
+            for i, robot_a in enumerate(robot_ids):
+                path_a = paths[robot_a]
+                a_prev, a_now = path_a[min(t - 1, len(path_a) - 1)], path_a[min(t, len(path_a) - 1)]
+                for robot_b in robot_ids[i + 1:]:
+                    path_b = paths[robot_b]
+                    b_prev, b_now = path_b[min(t - 1, len(path_b) - 1)], path_b[min(t, len(path_b) - 1)]
+                    if a_prev == b_now and a_now == b_prev and a_prev != a_now:
+                        return [(robot_a, (a_prev, a_now, t)), (robot_b, (b_prev, b_now, t))]
+        return None
+
+    def plan_single(self, start, goal, heuristic, constraints):
+        """A* espacio-temporal de un robot respetando sus restricciones"""
+        width, height = self.width, self.height
+        blocked_map = self.blocked_map
+        # Paso a partir del cual ya no hay restricciones: los estados se pueden fusionar
+        last_constrained = max((constraint[-1] for constraint in constraints), default=0)
+        goal_constrained_until = max((constraint[1] for constraint in constraints
+                                      if len(constraint) == 2 and constraint[0] == goal), default=-1)
+
+        came_from = {}
+        closed = set()
+        counter = 0
+        open_heap = [(heuristic(start, goal), counter, start, 0)]
+        while open_heap:
+            _, _, pos, t = heapq.heappop(open_heap)
+            key = (pos, min(t, last_constrained + 1))
+            if key in closed:
+                continue
+            closed.add(key)
+
+            if pos == goal and t > goal_constrained_until:
+                path = [pos]
+                state = (pos, t)
+                while state in came_from:
+                    state = came_from[state]
+                    path.append(state[0])
+                path.reverse()
+                return path
+
+            lanes = self.lane_map[pos[0] * height + pos[1]] if self.lane_map is not None else 0
+            for dx, dy, bit, _ in LANE_MOVES + [(0, 0, 0, 0)]:
+                if lanes and bit and not lanes & bit:
+                    continue
+                nx, ny = pos[0] + dx, pos[1] + dy
+                if not (0 <= nx < width and 0 <= ny < height) or blocked_map[nx * height + ny]:
+                    continue
+                neighbor = (nx, ny)
+                if neighbor in self.extra_blocked and neighbor != start:
+                    continue
+                if (neighbor, t + 1) in constraints or (pos, neighbor, t + 1) in constraints:
+                    continue
+                if (neighbor, min(t + 1, last_constrained + 1)) in closed:
+                    continue
+                if (neighbor, t + 1) not in came_from:
+                    came_from[(neighbor, t + 1)] = (pos, t)
+                counter += 1
+                heapq.heappush(open_heap, (t + 1 + heuristic(neighbor, goal), counter, neighbor, t + 1))
+        return []
+
+class JumpPointSearch:
+    """Jump Point Search para el grid 4-conexo, usado cuando solo cuentan los obstáculos.
+
+    Sigue un orden canónico "horizontal primero": tras un movimiento horizontal se
+    puede seguir o girar en vertical, y tras uno vertical solo se gira en horizontal
+    cuando hay un vecino forzado (el lateral estaba bloqueado en la celda anterior y
+    libre en la actual). Los saltos verticales se leen de tablas precalculadas al
+    estilo JPS+, que se invalidan cuando cambia el mapa. Las longitudes de ruta son
+    las mismas que con A*, con muchas menos expansiones en pasillos abiertos.
+    """
+    def __init__(self, width, height, blocked_map):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.vertical_jumps = None  # {dy: array}: >0 salto hasta punto forzado, <=0 -pasos libres hasta pared
+        self.dirty_columns = set()  # Columnas a recalcular en la próxima búsqueda
+        self.nodes_expanded = 0
+
+    def invalidate(self, pos=None):
+        """
+        Marca las tablas de saltos como obsoletas; se recalculan en la próxima búsqueda.
+        
+        Con pos solo se marcan la columna del obstáculo y sus dos vecinas, que son
+        las únicas cuyos saltos verticales o vecinos forzados dependen de esa celda.
+        """
+        if pos is None:
+            self.vertical_jumps = None
+            self.dirty_columns.clear()
+        elif self.vertical_jumps is not None:
+            self.dirty_columns.update(x for x in (pos[0] - 1, pos[0], pos[0] + 1) if 0 <= x < self.width)
+
+    def is_open(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and not self.blocked_map[x * self.height + y]
+
+    def build_tables(self):
+        self.vertical_jumps = {dy: array('i', [0]) * (self.width * self.height) for dy in (1, -1)}
+        for x in range(self.width):
+            self.build_column(x)
+        self.dirty_columns.clear()
+
+    def build_column(self, x):
+        """Recalcula los saltos verticales de una columna (solo dependen de ella y sus vecinas)"""
+        width, height = self.width, self.height
+        for dy in (1, -1):
+            jumps = self.vertical_jumps[dy]
+            rows = range(height - 1, -1, -1) if dy == 1 else range(height)
+            for y in rows:
+                ny = y + dy
+                if not self.is_open(x, ny):
+                    jumps[x * height + y] = 0  # Pared inmediata: 0 pasos libres
+                    continue
+                forced = any(not self.is_open(x + dx, y) and 0 <= x + dx < width and self.is_open(x + dx, ny)
+                             for dx in (-1, 1))
+                if forced:
+                    jumps[x * height + y] = 1
+                else:
+                    following = jumps[x * height + ny]
+                    jumps[x * height + y] = following + 1 if following > 0 else following - 1
+
+    def jump_vertical(self, x, y, dy, goal):
+        """Siguiente punto de salto en vertical desde (x, y), o None"""
+        jump = self.vertical_jumps[dy][x * self.height + y]
+        reach = jump if jump > 0 else -jump
+        if goal[0] == x and 0 < (goal[1] - y) * dy <= reach:
+            return goal
+        if jump > 0:
+            return (x, y + jump * dy)
+        return None
+
+    def jump_horizontal(self, x, y, dx, goal):
+        """Siguiente punto de salto en horizontal desde (x, y), o None"""
+        while True:
+            x += dx
+            if not self.is_open(x, y):
+                return None
+            if (x, y) == goal:
+                return goal
+            # Un giro vertical desde aquí encuentra algo: esta celda es punto de salto
+            if self.jump_vertical(x, y, 1, goal) is not None or self.jump_vertical(x, y, -1, goal) is not None:
+                return (x, y)
+
+    def successor_directions(self, pos, direction):
+        if direction is None:
+            return MOVES
+        dx, dy = direction
+        if dy == 0:
+            return [(dx, 0), (0, 1), (0, -1)]
+        # Llegada vertical: seguir recto y girar solo hacia vecinos forzados
+        x, y = pos
+        directions = [(0, dy)]
+        for side in (-1, 1):
+            if self.is_open(x + side, y) and not self.is_open(x + side, y - dy):
+                directions.append((side, 0))
+        return directions
+
+    def search(self, start, goal):
+        """Devuelve la ruta celda a celda de start a goal o [] si no existe"""
+        if self.vertical_jumps is None:
+            self.build_tables()
+        elif self.dirty_columns:
+            for x in self.dirty_columns:
+                self.build_column(x)
+            self.dirty_columns.clear()
+        self.nodes_expanded = 0
+        if start == goal:
+            return [start]
+
+        # Los estados distinguen el eje de llegada, que determina los sucesores
+        start_state = (start, None)
+        g_score = {start_state: 0}
+        came_from = {}
+        closed = set()
+        counter = 0
+        open_heap = [(manhattan(start, goal), counter, start_state, None)]
+        while open_heap:
+            _, _, state, direction = heapq.heappop(open_heap)
+            if state in closed:
+                continue
+            pos = state[0]
+            if pos == goal:
+                return self.reconstruct_path(came_from, state)
+            closed.add(state)
+            self.nodes_expanded += 1
+
+            for dx, dy in self.successor_directions(pos, direction):
+                if dy == 0:
+                    jump_point = self.jump_horizontal(pos[0], pos[1], dx, goal)
+                else:
+                    if not self.is_open(pos[0], pos[1] + dy):
+                        continue
+                    jump_point = self.jump_vertical(pos[0], pos[1], dy, goal)
+                if jump_point is None:
+                    continue
+                next_state = (jump_point, 'h' if dy == 0 else 'v')
+                tentative_g_score = g_score[state] + manhattan(pos, jump_point)
+                if next_state not in closed and tentative_g_score < g_score.get(next_state, float('inf')):
+                    g_score[next_state] = tentative_g_score
+                    came_from[next_state] = state
+                    counter += 1
+                    heapq.heappush(open_heap, (tentative_g_score + manhattan(jump_point, goal), counter,
+                                               next_state, (dx, dy)))
+        return []
+
+    @staticmethod
+    def reconstruct_path(came_from, state):
+        """Rellena los tramos rectos entre puntos de salto"""
+        jump_points = [state[0]]
+        while state in came_from:
+            state = came_from[state]
+            jump_points.append(state[0])
+        jump_points.reverse()
+
+        path = [jump_points[0]]
+        for (x, y), (tx, ty) in zip(jump_points, jump_points[1:]):
+            step_x = (tx > x) - (tx < x)
+            step_y = (ty > y) - (ty < y)
+            while (x, y) != (tx, ty):
+                x, y = x + step_x, y + step_y
+                path.append((x, y))
+        return path
+
+class HierarchicalPlanner:
+    """Planificador jerárquico (HPA*) para rutas largas en mapas grandes.
+
+    El grid se divide en clusters de cluster_size x cluster_size. En cada frontera
+    entre clusters vecinos, cada tramo libre a ambos lados da una entrada (dos si el
+    tramo es largo) formada por el par de celdas enfrentadas. Las distancias entre
+    las entradas de un mismo cluster se calculan con BFS sin salir del cluster y se
+    guardan; al añadir un obstáculo solo se recalculan los clusters afectados, la
+    próxima vez que se consulte el grafo. Las rutas se buscan en el grafo abstracto
+    y se refinan celda a celda tramo a tramo, de modo que el robot solo necesita
+    tener detallados unos pocos clusters por delante.
+
+    Las rutas pasan por las entradas de cada frontera, así que pueden ser algo más
+    largas que la óptima: el modelo solo lo usa si se activa hierarchical_planning.
+    """
+    def __init__(self, width, height, blocked_map, cluster_size=10):
+        self.width = width
+        self.height = height
+        self.blocked_map = blocked_map
+        self.cluster_size = cluster_size
+        self.clusters_x = (width + cluster_size - 1) // cluster_size
+        self.clusters_y = (height + cluster_size - 1) // cluster_size
+        self.border_entrances = {}  # (cluster, cluster vecino) -> [(celda, celda enfrentada)]
+        self.inter_edges = {}  # celda de entrada -> celdas enfrentadas en clusters vecinos
+        self.intra_edges = {}  # cluster -> {entrada: {otra entrada: distancia}}
+        self.dirty_clusters = set((cx, cy) for cx in range(self.clusters_x) for cy in range(self.clusters_y))
+        self.nodes_expanded = 0
+
+    def cluster_of(self, pos):
+        return (pos[0] // self.cluster_size, pos[1] // self.cluster_size)
+
+    def cluster_bounds(self, cluster):
+        """Límites (x0, y0, x1, y1) del cluster, con x1 e y1 excluidos"""
+        x0, y0 = cluster[0] * self.cluster_size, cluster[1] * self.cluster_size
+        return x0, y0, min(x0 + self.cluster_size, self.width), min(y0 + self.cluster_size, self.height)
+
+    def is_open(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height and not self.blocked_map[x * self.height + y]
+
+    def mark_dirty(self, pos):
+        """Marca el cluster de una celda que ha cambiado; sus fronteras se recalculan con él"""
+        self.dirty_clusters.add(self.cluster_of(pos))
+
+    def cluster_borders(self, cluster):
+        """Fronteras del cluster como pares (cluster izquierdo/inferior, cluster derecho/superior)"""
+        cx, cy = cluster
+        borders = []
+        if cx > 0:
+            borders.append(((cx - 1, cy), cluster))
+        if cx < self.clusters_x - 1:
+            borders.append((cluster, (cx + 1, cy)))
+        if cy > 0:
+            borders.append(((cx, cy - 1), cluster))
+        if cy < self.clusters_y - 1:
+            borders.append((cluster, (cx, cy + 1)))
+        return borders
+
+    def build_border(self, border):
+        """Entradas de una frontera: el centro de cada tramo libre, o sus extremos si es largo"""
+        cluster, neighbor = border
+        x0, y0, x1, y1 = self.cluster_bounds(cluster)
+        if neighbor[0] > cluster[0]:
+            pairs = [((x1 - 1, y), (x1, y)) for y in range(y0, y1)]
+        else:
+            pairs = [((x, y1 - 1), (x, y1)) for x in range(x0, x1)]
+
+        entrances = []
+        segment = []
+        for pair in pairs + [None]:
+            if pair is not None and self.is_open(*pair[0]) and self.is_open(*pair[1]):
+                segment.append(pair)
+                continue
+            if len(segment) >= 6:
+                entrances.extend((segment[0], segment[-1]))
+            elif segment:
+                entrances.append(segment[len(segment) // 2])
+            segment = []
+        return entrances
+
+    def cluster_distances(self, source, cluster):
+        """Distancias BFS desde source sin salir del cluster"""
+        x0, y0, x1, y1 = self.cluster_bounds(cluster)
+        height, blocked_map = self.height, self.blocked_map
+        distances = {source: 0}
+        queue = deque([source])
+        while queue:
+            pos = queue.popleft()
+            next_distance = distances[pos] + 1
+            for dx, dy in MOVES:
+                nx, ny = pos[0] + dx, pos[1] + dy
+                if x0 <= nx < x1 and y0 <= ny < y1 and not blocked_map[nx * height + ny] \
+                        and (nx, ny) not in distances:
+                    distances[(nx, ny)] = next_distance
+                    queue.append((nx, ny))
+        return distances
+
+    def rebuild(self):
+        """Recalcula las entradas y distancias internas de los clusters marcados"""
+        if not self.dirty_clusters:
+            return
+        borders = set()
+        affected = set()
+        for cluster in self.dirty_clusters:
+            borders.update(self.cluster_borders(cluster))
+            affected.add(cluster)
+        self.dirty_clusters = set()
+
+        for border in borders:
+            for a, b in self.border_entrances.get(border, ()):
+                self.inter_edges[a].discard(b)
+                self.inter_edges[b].discard(a)
+            entrances = self.build_border(border)
+            self.border_entrances[border] = entrances
+            for a, b in entrances:
+                self.inter_edges.setdefault(a, set()).add(b)
+                self.inter_edges.setdefault(b, set()).add(a)
+            # Las entradas del cluster vecino también han podido cambiar
+            affected.update(border)
+
+        for cluster in affected:
+            nodes = set()
+            for border in self.cluster_borders(cluster):
+                for a, b in self.border_entrances.get(border, ()):
+                    nodes.add(a if self.cluster_of(a) == cluster else b)
+            edges = {}
+            for node in nodes:
+                distances = self.cluster_distances(node, cluster)
+                edges[node] = {other: distances[other] for other in nodes
+                               if other != node and other in distances}
+            self.intra_edges[cluster] = edges
+
+    def find_route(self, start, goal):
+        """Ruta abstracta [(punto, coste acumulado), ...] de start a goal, o None si no existe"""
+        self.rebuild()
+        self.nodes_expanded = 0
+        start_cluster = self.cluster_of(start)
+        goal_cluster = self.cluster_of(goal)
+
+        # Conectar start y goal con las entradas de su cluster solo para esta búsqueda
+        distances = self.cluster_distances(start, start_cluster)
+        start_edges = {node: distances[node] for node in self.intra_edges.get(start_cluster, {})
+                       if node != start and node in distances}
+        if goal in distances:
+            start_edges[goal] = distances[goal]
+        distances = self.cluster_distances(goal, goal_cluster)
+        goal_edges = {node: distances[node] for node in self.intra_edges.get(goal_cluster, {})
+                      if node in distances}
+
+        g_score = {start: 0}
+        came_from = {}
+        closed = set()
+        counter = 0
+        open_heap = [(manhattan(start, goal), counter, start)]
+        while open_heap:
+            _, _, node = heapq.heappop(open_heap)
+            if node in closed:
+                continue
+            if node == goal:
+                route = [(node, g_score[node])]
+                while node in came_from:
+                    node = came_from[node]
+                    route.append((node, g_score[node]))
+                route.reverse()
+                return route
+            closed.add(node)
+            self.nodes_expanded += 1
+
+            if node == start:
+                neighbors = list(start_edges.items())
+            else:
+                neighbors = list(self.intra_edges[self.cluster_of(node)].get(node, {}).items())
+                if node in goal_edges:
+                    neighbors.append((goal, goal_edges[node]))
+            neighbors.extend((other, 1) for other in self.inter_edges.get(node, ()))
+
+            for neighbor, cost in neighbors:
+                tentative_g_score = g_score[node] + cost
+                if neighbor not in closed and tentative_g_score < g_score.get(neighbor, float('inf')):
+                    g_score[neighbor] = tentative_g_score
+                    came_from[neighbor] = node
+                    counter += 1
+                    heapq.heappush(open_heap, (tentative_g_score + manhattan(neighbor, goal), counter, neighbor))
+        return None
+
+    def refine_segment(self, a, b):
+        """Ruta celda a celda entre dos puntos consecutivos de una ruta abstracta"""
+        if self.cluster_of(a) != self.cluster_of(b):
+            return [a, b]  # Cruce de frontera
+        x0, y0, x1, y1 = self.cluster_bounds(self.cluster_of(a))
+        search = AStarSearch(self.width, self.height, self.blocked_map,
+                             is_passable=lambda pos: x0 <= pos[0] < x1 and y0 <= pos[1] < y1)
+        return search.search(a, b)
+
+    def refine_route(self, route, max_clusters=None):
+        """Refina la ruta abstracta hasta cruzar max_clusters fronteras (None = completa).
+
+        Devuelve (ruta, resto) donde el resto empieza en la última celda de la ruta,
+        o ([], route) si algún tramo ya no es transitable.
+        """
+        path = [route[0][0]]
+        crossings = 0
+        index = 0
+        while index < len(route) - 1 and (max_clusters is None or crossings < max_clusters):
+            a, b = route[index][0], route[index + 1][0]
+            segment = self.refine_segment(a, b)
+            if not segment:
+                return [], route
+            path.extend(segment[1:])
+            if self.cluster_of(a) != self.cluster_of(b):
+                crossings += 1
+            index += 1
+        return path, route[index:]
+
+    def find_path(self, start, goal):
+        """Ruta completa de start a goal refinada desde el grafo abstracto, o [] si no existe"""
+        route = self.find_route(start, goal)
+        if route is None:
+            return []
+        path, _ = self.refine_route(route)
+        return path
+
 class RobotAgent(Agent):
     def __init__(self, unique_id, model, start, goal, color="red", 
                  max_battery=100, battery_drain_rate=0.5, battery_level=None):
@@ -86,7 +1842,14 @@ class RobotAgent(Agent):
             
         self.start = start
         self.goal = goal
-        self.path = self.astar(start, goal)
+        self.pending_route = []  # Resto de la ruta abstracta (HPA*) aún sin refinar
+        self.flow_target = None  # Destino seguido por campo de flujo (solo se guarda el paso siguiente)
+        self.flow_tail = None  # Última celda de la ruta fijada por el campo de flujo
+        self.timed_path = False  # La ruta viene de un planificador espacio-temporal (con esperas)
+        self.search_budget = None  # SearchBudget activo durante una replanificación
+        self.partial_destination = None  # Destino pendiente si la última ruta quedó parcial
+        self.partial_tail = None  # Última celda de esa ruta parcial
+        self.path = self.plan_route(start, goal)
         self.steps_taken = 0
         self.color = color  
         self.reached_goal = False
@@ -103,7 +1866,7 @@ class RobotAgent(Agent):
         self.waiting_time = 0   # Tiempo de espera cuando hay bloqueo
         self.last_position = None  # Para detectar si el robot está atascado
         self.position_unchanged_count = 0  # Contador de pasos en los que no ha cambiado de posición
-        self.alternative_paths_tried = []  # Guardar rutas alternativas ya intentadas
+        self.alternative_paths_tried = OrderedDict()  # Huellas de las últimas rutas alternativas intentadas
         self.priority = 1  # Prioridad base del robot 
         self.returning_to_task = False
         # Añadir estas líneas al final del constructor:
@@ -132,102 +1895,167 @@ class RobotAgent(Agent):
             print(f"Robot {unique_id}: Nivel de batería: {self.battery_level}%")
     
     
+    @property
+    def path(self):
+        return self._path
+    
+    @path.setter
+    def path(self, positions):
+        # Cualquier ruta asignada (lista o RobotPath) se guarda en formato compacto
+        self._path = None if positions is None else RobotPath(positions, self.model.grid.height)
+        # Solo CBS y la reserva cooperativa marcan sus rutas como temporizadas tras asignarlas
+        self.timed_path = False
+    
     def calculate_emergency_path(self, start, goal):
         """Calcula una ruta de emergencia directa hacia la estación de carga.
         Usa A* simple sin preocuparse tanto por penalizaciones de robots."""
-        
-        def heuristic(a, b):
-            # Distancia Manhattan
-            return abs(a[0] - b[0]) + abs(a[1] - b[1])
-        
-        open_set = [start]
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: heuristic(start, goal)}
-        
-        while open_set:
-            current = min(open_set, key=lambda x: f_score.get(x, float('inf')))
-            if current == goal:
-                # Reconstruir el camino
-                path = [current]
-                while current in came_from:
-                    current = came_from[current]
-                    path.insert(0, current)
-                print(f"Robot {self.unique_id}: Ruta de emergencia encontrada, longitud: {len(path)}")
-                return path
-            
-            open_set.remove(current)
-            
-            # Explorar los 4 movimientos cardinales básicos
-            for d in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
-                neighbor = (current[0] + d[0], current[1] + d[1])
-                
-                # Verificar límites del grid
-                if 0 <= neighbor[0] < self.model.grid.width and 0 <= neighbor[1] < self.model.grid.height:
-                    # Solo evitar obstáculos, ignorar otros robots
-                    if not self.model.has_obstacle(neighbor):
-                        tentative_g_score = g_score[current] + 1
-                        if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                            came_from[neighbor] = current
-                            g_score[neighbor] = tentative_g_score
-                            f_score[neighbor] = tentative_g_score + heuristic(neighbor, goal)
-                            if neighbor not in open_set:
-                                open_set.append(neighbor)
+        # Solo evitar obstáculos, ignorar otros robots
+        path = self.model.find_static_path(start, goal)
+        if path:
+            print(f"Robot {self.unique_id}: Ruta de emergencia encontrada, longitud: {len(path)}")
+            return path
         
         # Si no se encuentra ruta, intentar con el método normal
         print(f"Robot {self.unique_id}: No se pudo encontrar ruta de emergencia, usando método normal")
         return self.calculate_path_to_station(self.find_nearest_charging_station())
     
+    def make_search(self, is_passable=None, move_cost=None, heuristic=manhattan):
+        """Configura el motor A* compartido sobre el grid y el mapa de obstáculos del modelo"""
+        return AStarSearch(self.model.grid.width, self.model.grid.height, self.model.obstacle_map,
+                           is_passable, move_cost, heuristic, budget=self.search_budget,
+                           lane_map=self.model.lane_map)
+    
+    def start_search_budget(self):
+        """Abre un presupuesto para las búsquedas de una replanificación"""
+        self.search_budget = SearchBudget(self.model.replan_max_expansions, self.model.replan_time_budget)
+        return self.search_budget
+    
+    def resume_partial_route(self):
+        """Continúa una ruta parcial (cortada por presupuesto) cuando el robot se acerca a su final"""
+        destination = self.partial_destination
+        self.partial_destination = None
+        if not self.path or self.path[-1] != self.partial_tail:
+            return  # La ruta se ha sustituido por otra
+        budget = self.start_search_budget()
+        try:
+            continuation = self.astar(self.path[-1], destination)
+        finally:
+            self.search_budget = None
+        if continuation and len(continuation) > 1:
+            self.path.extend(continuation[1:])
+            if budget.exhausted and continuation[-1] != destination:
+                self.partial_destination = destination
+                self.partial_tail = continuation[-1]
+    
+    def is_free_for_robot(self, pos):
+        """Celda sin otro robot detenido en ella (los obstáculos los filtra el motor)"""
+        # Solo considerar como bloqueado si algún otro robot de la celda no está en movimiento
+        return all(robot is self or pos == robot.goal for robot in self.model.robots_at(pos))
+    
     def astar(self, start, goal):
-        def heuristic(a, b):
-            # Distancia Manhattan adaptada al nuevo sistema de coordenadas
-            return abs(a[0] - b[0]) + abs(a[1] - b[1])
-        
-        open_set = [start]
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: heuristic(start, goal)}
-        
-        while open_set:
-            current = min(open_set, key=lambda x: f_score.get(x, float('inf')))
-            if current == goal:
-                return self.reconstruct_path(came_from, current)
-            
-            open_set.remove(current)
-            # Definimos los movimientos posibles: derecha, izquierda, arriba, abajo
-            # En este sistema, x aumenta hacia la izquierda
-            for d in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
-                neighbor = (current[0] + d[0], current[1] + d[1])
-                
-                # Verificar si está dentro de los límites del grid
-                if 0 <= neighbor[0] < self.model.grid.width and 0 <= neighbor[1] < self.model.grid.height:
-                    # Verificar si hay obstáculos
-                    if not self.model.has_obstacle(neighbor):
-                        # Verificar si hay otros robots en la posición
-                        # Solo considerar como bloqueado si el robot no está en movimiento
-                        robot_blocking = False
-                        for robot in self.model.robots:
-                            if robot.unique_id != self.unique_id and robot.pos == neighbor and neighbor != robot.goal:
-                                robot_blocking = True
-                                break
-                        
-                        if not robot_blocking:
-                            tentative_g_score = g_score[current] + 1
-                            if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                                came_from[neighbor] = current
-                                g_score[neighbor] = tentative_g_score
-                                f_score[neighbor] = tentative_g_score + heuristic(neighbor, goal)
-                                if neighbor not in open_set:
-                                    open_set.append(neighbor)
-        return []
+        # Partir de la ruta más corta sin robots (campo de distancias o JPS)
+        path = self.model.find_static_path(start, goal)
+        if not path:
+            return []  # Inalcanzable incluso ignorando robots
+        # Coste suave por congestión: si la ruta cruza celdas con atascos recientes, repartir el tráfico
+        if self.model.congestion_weight and any(self.model.congestion.value(pos) >= 1.0 for pos in path[1:]):
+            return self.make_search(self.is_free_for_robot, self.model.congestion_cost,
+                                    self.model.get_heuristic(goal)).search(start, goal)
+        # Si ningún robot detenido la bloquea, también es óptima considerando robots
+        if all(self.is_free_for_robot(pos) for pos in path[1:]):
+            return path
+        # Rutas largas sin campo de distancias: BFS bidireccional (misma longitud que A*).
+        # Con presupuesto o con carriles (el frente inverso no los respeta) se usa A*
+        if self.search_budget is None and self.model.lane_map is None and \
+                self.model.get_distance_field(goal) is None and \
+                manhattan(start, goal) >= self.model.bidirectional_min_distance:
+            return BidirectionalSearch(self.model.grid.width, self.model.grid.height, self.model.obstacle_map,
+                                       self.is_free_for_robot).search(start, goal)
+        # Si no, buscar con A*; la distancia de un campo es una heurística exacta sin robots
+        return self.make_search(self.is_free_for_robot,
+                                heuristic=self.model.get_heuristic(goal)).search(start, goal)
     
-    def reconstruct_path(self, came_from, current):
-        path = [current]
-        while current in came_from:
-            current = came_from[current]
-            path.insert(0, current)
+    def plan_route(self, start, goal):
+        """Ruta hacia goal; con HPA* activo, en mapas grandes solo se detallan los primeros clusters"""
+        self.pending_route = []
+        self.flow_target = None
+        if self.model.flow_field_navigation and self.model.get_distance_field(goal) is not None:
+            next_pos = self.model.get_distance_field(goal).next_step(start, self.is_free_for_robot)
+            if next_pos is not None:
+                # Modo campo de flujo: la ruta se reduce al siguiente paso y se renueva en cada paso
+                self.flow_target = goal
+                self.flow_tail = next_pos
+                return [start, next_pos]
+        planner = self.model.get_hierarchical_planner(start, goal)
+        if planner is None:
+            return self.astar(start, goal)
+        route = planner.find_route(start, goal)
+        if route is None:
+            return []
+        path, pending = planner.refine_route(route, self.model.refine_ahead_clusters)
+        if not path:
+            return self.astar(start, goal)
+        if not all(self.is_free_for_robot(pos) for pos in path[1:]):
+            # Rodear los robots detenidos solo en el tramo detallado
+            path = self.make_search(self.is_free_for_robot).search(start, path[-1])
+            if not path:
+                return self.astar(start, goal)
+        self.pending_route = pending if len(pending) > 1 else []
         return path
     
+    def extend_route(self):
+        """Refina los siguientes clusters de la ruta abstracta cuando la ruta detallada se agota"""
+        if not self.pending_route:
+            return
+        if not self.path or self.path[-1] != self.pending_route[0][0]:
+            self.pending_route = []  # La ruta se ha sustituido por otra
+            return
+        planner = self.model.hierarchical_planner
+        path, pending = planner.refine_route(self.pending_route, self.model.refine_ahead_clusters)
+        if not path:
+            # El mapa cambió en algún cluster: replanificar el resto desde el final de la ruta
+            route = planner.find_route(self.path[-1], self.pending_route[-1][0])
+            if route is None:
+                self.pending_route = []
+                return
+            path, pending = planner.refine_route(route, self.model.refine_ahead_clusters)
+        self.path.extend(path[1:])
+        self.pending_route = pending if len(pending) > 1 else []
+    
+    def path_distance_to(self, pos):
+        """Pasos reales hasta pos evitando obstáculos, o inf si es inalcanzable"""
+        distance = self.model.get_wavefront(pos)[self.pos[0], self.pos[1]]
+        return float('inf') if distance < 0 else int(distance)
+    
+    def in_flow_mode(self):
+        """El robot sigue un campo de flujo y su ruta no se ha sustituido por otra"""
+        return self.flow_target is not None and bool(self.path) and self.path[-1] == self.flow_tail
+    
+    def follow_flow_field(self):
+        """Renueva el paso siguiente leyendo el campo de flujo del destino (coste constante)"""
+        if not self.in_flow_mode():
+            self.flow_target = None
+            return
+        if self.pos == self.flow_target:
+            self.path = [self.pos]
+            self.flow_target = None
+            return
+        # Evitación local: preferir un descenso que no ocupe un robot detenido
+        next_pos = self.model.get_distance_field(self.flow_target).next_step(self.pos, self.is_free_for_robot)
+        if next_pos is None:
+            self.flow_target = None  # El destino ha quedado inalcanzable
+            return
+        self.path = [self.pos, next_pos]
+        self.flow_tail = next_pos
+    
+    def pending_route_cost(self):
+        """Pasos que quedan tras el final de la ruta detallada (ruta abstracta o campo de flujo)"""
+        if self.in_flow_mode():
+            return self.model.get_distance_field(self.flow_target).distance(self.flow_tail) or 0
+        if self.pending_route and self.path and self.path[-1] == self.pending_route[0][0]:
+            return self.pending_route[-1][1] - self.pending_route[0][1]
+        return 0
+    
     def check_robots_health(self):
         """Verifica periódicamente el estado de todos los robots"""
         for robot in self.robots:
@@ -251,7 +2079,7 @@ class RobotAgent(Agent):
     def handle_charging_station_arrival(self):
         """Maneja la llegada a una estación de carga y la carga de batería"""
         # Buscar si estamos en una estación de carga
-        station = next((s for s in self.model.charging_stations if s.pos == self.pos), None)
+        station = self.model.get_station_at(self.pos)
         
         if not station:
             # Si no estamos en una estación, limpiar los estados relacionados con la carga
@@ -287,8 +2115,6 @@ class RobotAgent(Agent):
         
         # Si estamos esperando en la cola
         if self.waiting_for_charge:
-            # En lugar de intentar acceder directamente a station.queue, 
-            # usamos un método existente para verificar si seguimos en la cola
             if station.is_next_in_queue(self.unique_id) or self.is_in_station_queue(station):
                 print(f"Robot {self.unique_id}: Esperando en cola de estación {station.pos}")
                 
@@ -306,23 +2132,8 @@ class RobotAgent(Agent):
         return False
 
     def is_in_station_queue(self, station):
-        """Comprueba si el robot está en la cola de la estación sin acceder directamente a la cola"""
-        # Implementamos un método auxiliar que verifica si el robot está en la cola
-        # sin acceder directamente al atributo queue
-        try:
-            # Intentar añadirnos a la cola y ver si falla
-            # Si ya estamos en la cola, debería fallar o retornar False
-            result = station.add_to_queue(self.unique_id)
-            if result is False:  # Si el método retorna False explícitamente
-                return True      # Estamos ya en la cola
-            else:
-                # Si tuvo éxito añadiéndonos, nos quitamos inmediatamente
-                station.remove_from_queue(self.unique_id)
-                return False
-        except Exception:
-            # Si hubo un error (como intentar añadir un robot que ya está),
-            # asumimos que estamos en la cola
-            return True
+        """Comprueba si el robot está en la cola de la estación (o ya cargando en ella)"""
+        return station.contains(self.unique_id) or station.current_robot == self.unique_id
 
     def prioritize_charging_stations(self):
         """Busca y prioriza estaciones de carga basado en la ocupación y distancia"""
@@ -333,8 +2144,8 @@ class RobotAgent(Agent):
         # Encontrar todas las estaciones ordenadas por distancia
         stations_by_distance = []
         for station in self.model.charging_stations:
-            # Calcular distancia Manhattan
-            distance = abs(self.pos[0] - station.pos[0]) + abs(self.pos[1] - station.pos[1])
+            # Distancia real por el grid (inf si no se puede llegar)
+            distance = self.path_distance_to(station.pos)
             
             # Considerar si hay batería suficiente para llegar a esta estación
             # Añadir 10% más como margen de seguridad
@@ -372,21 +2183,50 @@ class RobotAgent(Agent):
             
         best_station = None
         min_wait_time = float('inf')
+        now = self.model.schedule.steps
         
         for station, distance, _ in reachable_stations:
-            # Estimar tiempo de espera: robots en cola + robot actual (si existe)
-            wait_time = len(station.waiting_queue)
-            if station.current_robot is not None:
-                wait_time += 1
-                
-            # Añadir el tiempo de viaje (cada paso es una unidad de tiempo)
-            total_wait = wait_time + distance
+            # Turno previsto: la estación queda libre tras la carga en curso y los turnos
+            # de la cola (cada uno según su déficit de batería y la tasa de carga)
+            start = station.predicted_start(now, now + distance, self.model.robots_by_id)
+            
+            # Viaje + espera + carga (cada paso es una unidad de tiempo)
+            battery_on_arrival = self.battery_level - distance * self.battery_drain_rate
+            total_wait = start - now + station.charge_steps(self.charge_deficit(battery_on_arrival))
             
             if total_wait < min_wait_time:
                 min_wait_time = total_wait
                 best_station = station
         
         return best_station
+    
+    def charge_deficit(self, battery_level=None):
+        """Batería que falta hasta el 95%, nivel al que el robot deja la estación"""
+        level = self.battery_level if battery_level is None else battery_level
+        return max(0, self.max_battery * 0.95 - level)
+    
+    def charging_eta(self, station):
+        """(pasos hasta la estación, pasos de carga al llegar) según la ruta actual, o None si no va hacia ella"""
+        if self.in_flow_mode() and self.flow_target == station.pos:
+            # La ruta solo guarda el paso siguiente: la distancia sale del campo del destino
+            remaining = self.model.get_distance_field(station.pos).distance(self.pos)
+            if remaining is None:
+                return None
+        elif not self.path or self.path[-1] != station.pos:
+            return None
+        else:
+            remaining = len(self.path) - 1
+        battery_on_arrival = self.battery_level - remaining * self.battery_drain_rate
+        return remaining, station.charge_steps(self.charge_deficit(battery_on_arrival))
+    
+    def book_charging_slot(self, station):
+        """Entra en la cola de la estación reservando turno con la llegada y la carga previstas"""
+        distance = self.path_distance_to(station.pos)
+        if distance == float('inf'):
+            return station.add_to_queue(self.unique_id)
+        battery_on_arrival = self.battery_level - distance * self.battery_drain_rate
+        return station.book_slot(self.unique_id, self.model.schedule.steps + distance,
+                                 station.charge_steps(self.charge_deficit(battery_on_arrival)))
 
     def change_goal(self, new_goal):
         """
@@ -409,7 +2249,7 @@ class RobotAgent(Agent):
         self.reached_goal = False
         
         # Calcular la nueva ruta desde la posición actual hasta la nueva meta
-        self.path = self.astar(self.pos, new_goal)
+        self.path = self.plan_route(self.pos, new_goal)
         
         # Si no se encontró una ruta, intentar métodos alternativos
         if not self.path or len(self.path) < 2:
@@ -517,20 +2357,60 @@ class RobotAgent(Agent):
         min_distance = float('inf')
         
         for station in self.model.charging_stations:
-            # Distancia Manhattan adaptada al nuevo sistema
-            distance = abs(self.pos[0] - station.pos[0]) + abs(self.pos[1] - station.pos[1])
+            # Distancia real por el grid, esquivando estanterías
+            distance = self.path_distance_to(station.pos)
             if distance < min_distance:
                 min_distance = distance
                 nearest = station
         
+        if nearest is None:
+            # Ninguna alcanzable: quedarse con la más cercana en línea recta
+            nearest = min(self.model.charging_stations, key=lambda station: manhattan(self.pos, station.pos))
         return nearest
     
+    def repair_path(self, blocked_pos):
+        """
+        Repara la ruta actual tras aparecer un obstáculo en blocked_pos.
+        
+        Si la ruta no pasa por la celda no se hace ningún trabajo. Si pasa, solo se
+        replanifica el tramo afectado: un desvío desde la celda anterior al obstáculo
+        hasta la siguiente, empalmado con el resto de la ruta (o el gradiente del
+        campo de distancias si el destino es fijo).
+        
+        Returns:
+            bool: True si la ruta actual sigue siendo válida, False si no se pudo reparar
+        """
+        if not self.path or blocked_pos not in self.path[1:]:
+            return True
+        
+        path = remove_path_loops(self.path)
+        index = path.index(blocked_pos)
+        destination = path[-1]
+        if index == 0:
+            # Solo lo cruzaba un ciclo que vuelve a la posición actual
+            self.path = path
+            return True
+        if index == len(path) - 1:
+            return False  # El propio destino quedó bloqueado
+        
+        if self.model.get_distance_field(destination) is not None:
+            # Destino fijo: la ruta completa sale del campo en O(longitud)
+            new_path = self.astar(path[0], destination)
+        else:
+            detour = self.astar(path[index - 1], path[index + 1])
+            new_path = remove_path_loops(path[:index - 1] + detour + path[index + 2:]) if detour else []
+        
+        if not new_path:
+            return False
+        self.path = new_path
+        return True
+    
     def calculate_path_to_station(self, station):
         """Calcula una ruta hacia la estación de carga"""
         if station is None:
             return []
             
-        return self.astar(self.pos, station.pos)
+        return self.plan_route(self.pos, station.pos)
     
     def charge_battery(self, amount):
         """Carga la batería con la cantidad especificada"""
@@ -614,12 +2494,13 @@ class RobotAgent(Agent):
                 self.path = self.calculate_path_to_station(best_station)
                     
                 if self.path:
-                    # Añadir a la cola de espera (SOLO si hay ruta válida)
-                    success = best_station.add_to_queue(self.unique_id)
+                    # Reservar turno en la cola de espera (SOLO si hay ruta válida)
+                    success = self.book_charging_slot(best_station)
                     if success:
                         # Verificar que el robot realmente esté en la cola antes de imprimir posición
-                        if self.unique_id in best_station.waiting_queue:
-                            queue_position = best_station.waiting_queue.index(self.unique_id) + 1
+                        queue_position = best_station.position_of(self.unique_id)
+                        if queue_position is not None:
+                            queue_position += 1
                             print(f"Robot {self.unique_id}: Redirigiendo a estación en {best_station.pos} ({len(self.path)} pasos). Posición en cola: {queue_position}")
                         else:
                             print(f"Robot {self.unique_id}: Redirigiendo a estación en {best_station.pos} ({len(self.path)} pasos).")
@@ -637,10 +2518,7 @@ class RobotAgent(Agent):
     
     def is_at_charging_station(self):
         """Verifica si el robot está en una estación de carga"""
-        for station in self.model.charging_stations:
-            if self.pos == station.pos:
-                return station
-        return None
+        return self.model.get_station_at(self.pos)
 
     def determine_priority_in_collision(self, other_robot):
         """
@@ -696,13 +2574,6 @@ class RobotAgent(Agent):
         if not self.path or len(self.path) <= 1:
             return True
         
-        nearest_station = self.find_nearest_charging_station()
-        if nearest_station:
-            distance_to_station = abs(self.pos[0] - nearest_station.pos[0]) + abs(self.pos[1] - nearest_station.pos[1])
-            if distance_to_station <= 3:  # Si está a 3 pasos o menos de una estación
-                print(f"Robot {self.unique_id}: Estación cercana a {distance_to_station} pasos. Permitiendo movimiento.")
-                return True
-        
         # Si acaba de salir de carga y tiene más del 90% de batería, permitir continuar
         if hasattr(self, 'just_charged') and self.just_charged:
             if self.battery_level >= self.max_battery * 0.9:
@@ -712,13 +2583,21 @@ class RobotAgent(Agent):
         drain_rate = self.energy_saving_drain_rate if self.energy_saving_mode else self.battery_drain_rate
         
         # En rutas cortas (menos de 20 pasos), siempre permitir continuar si tiene más de 40% batería
-        steps_left = len(self.path) - 1
+        steps_left = len(self.path) - 1 + self.pending_route_cost()
         if steps_left < 20 and self.battery_level >= self.max_battery * 0.4:
             return True
         
         # Para rutas medianas (20-40 pasos), necesita al menos 60% de batería
         if steps_left < 40 and self.battery_level >= self.max_battery * 0.6:
             return True
+        
+        # Los casos anteriores no necesitan distancias; a partir de aquí se usa el frente de onda
+        nearest_station = self.find_nearest_charging_station()
+        if nearest_station:
+            distance_to_station = self.path_distance_to(nearest_station.pos)
+            if distance_to_station <= 3:  # Si está a 3 pasos o menos de una estación
+                print(f"Robot {self.unique_id}: Estación cercana a {distance_to_station} pasos. Permitiendo movimiento.")
+                return True
             
         # Para rutas largas, hacer un cálculo preciso
         battery_needed = steps_left * drain_rate
@@ -732,9 +2611,11 @@ class RobotAgent(Agent):
         if self.carrying_package and self.package_destination:
             nearest_station = self.find_nearest_charging_station()
             if nearest_station:
-                # Calcular distancia estimada (Manhattan) al destino y luego a la estación
-                distance_to_station = abs(self.package_destination[0] - nearest_station.pos[0]) + \
-                                    abs(self.package_destination[1] - nearest_station.pos[1])
+                # Distancia real del destino a la estación (campo de distancias de la estación)
+                field = self.model.get_distance_field(nearest_station.pos)
+                distance_to_station = field.distance(tuple(self.package_destination)) if field else None
+                if distance_to_station is None:
+                    distance_to_station = manhattan(self.package_destination, nearest_station.pos)
                 extra_margin = distance_to_station * drain_rate * 0.5  # Factor 0.5 para no sobreestimar
         
         # Total de batería necesaria
@@ -785,7 +2666,7 @@ class RobotAgent(Agent):
         # Encontrar todas las estaciones ordenadas SOLO por distancia
         stations_by_distance = []
         for station in self.model.charging_stations:
-            distance = abs(self.pos[0] - station.pos[0]) + abs(self.pos[1] - station.pos[1])
+            distance = self.path_distance_to(station.pos)
             # Ignorar ocupación y solo considerar distancia
             stations_by_distance.append((station, distance))
         
@@ -805,8 +2686,7 @@ class RobotAgent(Agent):
                 print(f"Robot {self.unique_id}: ESTADO INCONSISTENTE DETECTADO - En estado de carga pero fuera de estación")
                 print(f"Robot {self.unique_id}: Posición actual: {self.pos}, Última posición conocida: {self.last_position}")
                 # Detectar robots cercanos que podrían haber causado un desplazamiento
-                nearby_robots = [r for r in self.model.robots if r.unique_id != self.unique_id and 
-                                abs(r.pos[0] - self.pos[0]) + abs(r.pos[1] - self.pos[1]) <= 2]
+                nearby_robots = [r for r in self.model.robots_near(self.pos, 2) if r is not self]
                 if nearby_robots:
                     print(f"Robot {self.unique_id}: Robots cercanos: {[(r.unique_id, r.pos) for r in nearby_robots]}")
                 # Corregir el estado inconsistente
@@ -835,6 +2715,12 @@ class RobotAgent(Agent):
             return
         
         self.check_state_consistency()
+        if self.pending_route and len(self.path) <= self.model.hierarchical_planner.cluster_size:
+            self.extend_route()
+        if self.partial_destination is not None and len(self.path) <= 2:
+            self.resume_partial_route()
+        if self.flow_target is not None:
+            self.follow_flow_field()
 
         # Verificar si está esperando para cargar en una estación
         if self.waiting_for_charge and self.charging_station_target:
@@ -845,7 +2731,7 @@ class RobotAgent(Agent):
                     return
             else:
                 # Si no está en la estación, pero está esperando, verificar si sigue en la cola
-                if self.charging_station_target and self.unique_id not in self.charging_station_target.waiting_queue:
+                if self.charging_station_target and not self.charging_station_target.contains(self.unique_id):
                     # Si ya no está en la cola (por algún motivo), resetear el estado
                     self.waiting_for_charge = False
                     self.charging_station_target = None
@@ -891,8 +2777,8 @@ class RobotAgent(Agent):
                     if not self.reached_goal:
                         self.original_path = self.path.copy() if self.path else []
                         
-                    # Añadirse a la cola previamente - Verificar que la operación sea exitosa
-                    add_success = best_station.add_to_queue(self.unique_id)
+                    # Reservar turno previamente - Verificar que la operación sea exitosa
+                    add_success = self.book_charging_slot(best_station)
                     
                     # Establecer la estación como destino
                     self.nearest_charging_station = best_station
@@ -902,8 +2788,9 @@ class RobotAgent(Agent):
                     if self.path:
                         if add_success:
                             # Solo intentar mostrar la posición en cola si se añadió correctamente
-                            if self.unique_id in best_station.waiting_queue:
-                                queue_pos = best_station.waiting_queue.index(self.unique_id) + 1
+                            queue_pos = best_station.position_of(self.unique_id)
+                            if queue_pos is not None:
+                                queue_pos += 1
                                 print(f"Robot {self.unique_id}: Redirigiendo a estación en {best_station.pos}. Nueva ruta calculada. Posición en cola: {queue_pos}")
                             else:
                                 print(f"Robot {self.unique_id}: Redirigiendo a estación en {best_station.pos}. Nueva ruta calculada.")
@@ -911,7 +2798,7 @@ class RobotAgent(Agent):
                             print(f"Robot {self.unique_id}: Redirigiendo a estación en {best_station.pos}. Nueva ruta calculada.")
                     else:
                         # Si no se puede encontrar ruta, eliminar de la cola
-                        if self.unique_id in best_station.waiting_queue:
+                        if best_station.contains(self.unique_id):
                             best_station.remove_from_queue(self.unique_id)
                         self.nearest_charging_station = None
                         self.charging_station_target = None
@@ -989,17 +2876,17 @@ class RobotAgent(Agent):
                             next_pos = self.path[1]  # El siguiente paso en la ruta
                             
                             # Verificar si el siguiente paso está libre
-                            blocking_robot = None
-                            for robot in self.model.robots:
-                                if robot.unique_id != self.unique_id and robot.pos == next_pos:
-                                    blocking_robot = robot
-                                    break
+                            blocking_robot = self.model.robot_at(next_pos, exclude=self)
                             
-                            if blocking_robot is None:
+                            if not self.model.can_move(self.pos, next_pos):
+                                # El carril no lo permite: el movimiento normal replanificará la ruta
+                                print(f"Robot {self.unique_id}: El carril de {self.pos} no permite el movimiento forzado a {next_pos}")
+                                return
+                            elif blocking_robot is None:
                                 # El camino está libre, mover inmediatamente
                                 print(f"Robot {self.unique_id}: MOVIMIENTO FORZADO después de cargar a {next_pos}")
                                 self.path.pop(0)  # Eliminar posición actual
-                                self.model.grid.move_agent(self, next_pos)
+                                self.model.move_robot(self, next_pos)
                                 self.steps_taken += 1
                                 self.drain_battery()  # Consumir batería por el movimiento
                                 self.last_position = next_pos  # Actualizar última posición
@@ -1045,6 +2932,8 @@ class RobotAgent(Agent):
         # Actualizar contador de posición sin cambios
         if self.last_position == self.pos:
             self.position_unchanged_count += 1
+            if not self.waiting_for_charge:
+                self.model.congestion.record(self.pos)  # Las colas de carga no cuentan como atasco
         else:
             self.position_unchanged_count = 0
             self.last_position = self.pos
@@ -1095,6 +2984,12 @@ class RobotAgent(Agent):
                     return
 
         #  MOVIMIENTO NORMAL 
+        if self.timed_path and len(self.path) > 1 and self.path[1] == self.pos:
+            # Espera planificada por CBS o la reserva cooperativa: no se mueve ni consume batería
+            self.path.pop(0)
+            print(f"Robot {self.unique_id}: Esperando turno reservado en {self.pos}")
+            return
+        
         if len(self.path) > 1:  # Verificar que hay al menos un paso más en la ruta
             # Verificar si hay suficiente batería para moverse
             if not self.drain_battery():
@@ -1106,15 +3001,19 @@ class RobotAgent(Agent):
                 
             next_pos = self.path[1]  # El siguiente paso en la ruta
             
+            # La ruta se planificó antes de definir los carriles: replanificar hacia el mismo final
+            if not self.model.can_move(self.pos, next_pos):
+                print(f"Robot {self.unique_id}: El carril de {self.pos} no permite moverse a {next_pos}. Replanificando.")
+                new_path = self.astar(self.pos, self.path[-1])
+                if new_path:
+                    self.path = new_path
+                return
+            
             # DEBUG: Imprimir información de movimiento
             print(f"Robot {self.unique_id}: Intentando moverse de {self.pos} a {next_pos}")
             
             # Verificar si el siguiente paso está ocupado por otro robot
-            blocking_robot = None
-            for robot in self.model.robots:
-                if robot.unique_id != self.unique_id and robot.pos == next_pos:
-                    blocking_robot = robot
-                    break
+            blocking_robot = self.model.robot_at(next_pos, exclude=self)
             
             if blocking_robot is None:
                 # El camino está libre, moverse normalmente
@@ -1122,7 +3021,7 @@ class RobotAgent(Agent):
                 self.waiting_time = 0   # Resetear tiempo de espera
                 
                 self.path.pop(0)  # Eliminar posición actual de la ruta
-                self.model.grid.move_agent(self, next_pos)
+                self.model.move_robot(self, next_pos)
                 self.steps_taken += 1
                 
                 # Verificar si llegó a una estación de carga
@@ -1151,6 +3050,7 @@ class RobotAgent(Agent):
             else:
                 # Camino bloqueado por otro robot
                 self.blocked_count += 1
+                self.model.congestion.record(next_pos)
                 print(f"Robot {self.unique_id}: Bloqueado por Robot {blocking_robot.unique_id} (intento {self.blocked_count})")
                 
                 # Determinar qué robot tiene mayor prioridad usando el nuevo sistema de prioridades
@@ -1297,87 +3197,96 @@ class RobotAgent(Agent):
         if not destination:
             print(f"Robot {self.unique_id}: No se pudo determinar destino para ruta alternativa.")
             return False
+        
+        # Todas las estrategias comparten un presupuesto para acotar la duración del paso
+        budget = self.start_search_budget()
+        self.partial_destination = None
+        try:
+            # Para robots con batería crítica, usar métodos más agresivos primero
+            if self.critical_battery or self.battery_level < self.max_battery * 0.15:
+                # Primero intentar con penalización fuerte para alejarse de otros robots
+                print(f"Robot {self.unique_id}: Buscando ruta prioritaria por batería crítica...")
+                self.path = self.astar_with_robot_penalty(self.pos, destination, penalty_multiplier=2.0)
             
-        # Para robots con batería crítica, usar métodos más agresivos primero
-        if self.critical_battery or self.battery_level < self.max_battery * 0.15:
-            # Primero intentar con penalización fuerte para alejarse de otros robots
-            print(f"Robot {self.unique_id}: Buscando ruta prioritaria por batería crítica...")
-            self.path = self.astar_with_robot_penalty(self.pos, destination, penalty_multiplier=2.0)
-            
-            # Si no funciona, intentar con desvío
-            if not self.path or len(self.path) < 2:
-                self.path = self.find_path_with_detour(self.pos, destination)
+                # Si no funciona, intentar con desvío
+                if not self.path or len(self.path) < 2:
+                    self.path = self.find_path_with_detour(self.pos, destination)
                 
-            # Si aún no funciona, intentar A* normal
-            if not self.path or len(self.path) < 2:
+                # Si aún no funciona, intentar A* normal
+                if not self.path or len(self.path) < 2:
+                    self.path = self.astar(self.pos, destination)
+            else:
+                # Estrategia normal para robots sin problemas de batería
+                # Estrategia 1: Ruta normal A* (ya intentada pero volvemos a intentar por si hay cambios)
                 self.path = self.astar(self.pos, destination)
-        else:
-            # Estrategia normal para robots sin problemas de batería
-            # Estrategia 1: Ruta normal A* (ya intentada pero volvemos a intentar por si hay cambios)
-            self.path = self.astar(self.pos, destination)
             
-            # Si no encontró ruta o es la misma, probar con penalización de posiciones ocupadas
-            if not self.path or len(self.path) < 2 or self.path == old_path or self.path_in_tried_alternatives(self.path):
-                print(f"Robot {self.unique_id}: Buscando ruta con penalización de robots...")
-                self.path = self.astar_with_robot_penalty(self.pos, destination)
+                # Si no encontró ruta o es la misma, probar con penalización de posiciones ocupadas
+                if not self.path or len(self.path) < 2 or self.path == old_path or self.path_in_tried_alternatives(self.path):
+                    print(f"Robot {self.unique_id}: Buscando ruta con penalización de robots...")
+                    self.path = self.astar_with_robot_penalty(self.pos, destination)
             
-            # Si aún no encuentra ruta, intentar una ruta más larga con desvío
-            if not self.path or len(self.path) < 2 or self.path == old_path or self.path_in_tried_alternatives(self.path):
-                print(f"Robot {self.unique_id}: Buscando ruta con desvío...")
-                self.path = self.find_path_with_detour(self.pos, destination)
+                # Si aún no encuentra ruta, intentar una ruta más larga con desvío
+                if not self.path or len(self.path) < 2 or self.path == old_path or self.path_in_tried_alternatives(self.path):
+                    print(f"Robot {self.unique_id}: Buscando ruta con desvío...")
+                    self.path = self.find_path_with_detour(self.pos, destination)
         
-        # Desvío aleatorio como último recurso (para ambos casos)
-        if not self.path or len(self.path) < 2 or self.path == old_path or self.path_in_tried_alternatives(self.path):
-            print(f"Robot {self.unique_id}: Intentando desvío aleatorio...")
-            import random
+            # Desvío aleatorio como último recurso (para ambos casos)
+            if not self.path or len(self.path) < 2 or self.path == old_path or self.path_in_tried_alternatives(self.path):
+                print(f"Robot {self.unique_id}: Intentando desvío aleatorio...")
             
-            # Si tiene batería crítica, buscar puntos cercanos a estaciones conocidas
-            potential_points = []
-            if self.critical_battery and self.model.charging_stations:
-                for station in self.model.charging_stations:
-                    # Puntos alrededor de la estación
-                    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                        potential_points.append((station.pos[0] + dx, station.pos[1] + dy))
+                # Si tiene batería crítica, buscar puntos cercanos a estaciones conocidas
+                potential_points = []
+                if self.critical_battery and self.model.charging_stations:
+                    for station in self.model.charging_stations:
+                        # Puntos alrededor de la estación
+                        for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
+                            potential_points.append((station.pos[0] + dx, station.pos[1] + dy))
             
-            # Generar puntos aleatorios como respaldo
-            for _ in range(5):
-                random_x = random.randint(0, self.model.grid.width - 1)
-                random_y = random.randint(0, self.model.grid.height - 1)
-                potential_points.append((random_x, random_y))
+                # Filtrar puntos válidos
+                valid_points = []
+                for point in potential_points:
+                    # has_obstacle ya trata las celdas fuera del grid como bloqueadas
+                    if not self.model.has_obstacle(point):
+                        # Añadir distancia para ordenar
+                        distance = abs(self.pos[0] - point[0]) + abs(self.pos[1] - point[1])
+                        valid_points.append((point, distance))
             
-            # Filtrar puntos válidos
-            valid_points = []
-            for point in potential_points:
-                if (0 <= point[0] < self.model.grid.width and 
-                    0 <= point[1] < self.model.grid.height and
-                    not self.model.has_obstacle(point)):
-                    # Añadir distancia para ordenar
-                    distance = abs(self.pos[0] - point[0]) + abs(self.pos[1] - point[1])
-                    valid_points.append((point, distance))
+                # Ordenar por distancia (los puntos más cercanos primero)
+                valid_points.sort(key=lambda x: x[1])
             
-            # Ordenar por distancia (los puntos más cercanos primero)
-            valid_points.sort(key=lambda x: x[1])
+                # Como respaldo, cruces de pasillo ya ordenados por congestión y longitud del desvío
+                waypoints = [point for point, _ in valid_points]
+                waypoints.extend(self.model.rank_detour_waypoints(self.pos, destination, 5))
             
-            # Intentar encontrar ruta con cada punto
-            for punto_desvio, _ in valid_points:
-                # Buscar ruta hasta este punto
-                ruta_a_desvio = self.astar(self.pos, punto_desvio)
-                if ruta_a_desvio and len(ruta_a_desvio) > 1:
-                    # Para batería crítica, solo nos importa llegar al punto de desvío
-                    # que podría estar cerca de una estación
-                    if self.critical_battery:
-                        self.path = ruta_a_desvio
-                        print(f"Robot {self.unique_id}: Ruta de emergencia hacia {punto_desvio}")
-                        break
-                    # Para casos normales, buscar ruta completa
-                    else:
-                        # Luego buscar ruta desde ahí hasta el destino final
-                        ruta_desde_desvio = self.astar(punto_desvio, destination)
-                        if ruta_desde_desvio and len(ruta_desde_desvio) > 1:
-                            # Combinar las rutas (eliminar duplicado del punto de desvío)
-                            self.path = ruta_a_desvio + ruta_desde_desvio[1:]
-                            print(f"Robot {self.unique_id}: Ruta con desvío aleatorio encontrada a través de {punto_desvio}")
+                # Intentar encontrar ruta con cada punto
+                for punto_desvio in waypoints:
+                    # Buscar ruta hasta este punto
+                    ruta_a_desvio = self.astar(self.pos, punto_desvio)
+                    if ruta_a_desvio and len(ruta_a_desvio) > 1 and ruta_a_desvio[-1] == punto_desvio:
+                        # Para batería crítica, solo nos importa llegar al punto de desvío
+                        # que podría estar cerca de una estación
+                        if self.critical_battery:
+                            self.path = ruta_a_desvio
+                            print(f"Robot {self.unique_id}: Ruta de emergencia hacia {punto_desvio}")
                             break
+                        # Para casos normales, buscar ruta completa
+                        else:
+                            # Luego buscar ruta desde ahí hasta el destino final
+                            ruta_desde_desvio = self.astar(punto_desvio, destination)
+                            if ruta_desde_desvio and len(ruta_desde_desvio) > 1:
+                                # Combinar las rutas (eliminar duplicado del punto de desvío)
+                                self.path = ruta_a_desvio + ruta_desde_desvio[1:]
+                                print(f"Robot {self.unique_id}: Ruta con desvío aleatorio encontrada a través de {punto_desvio}")
+                                break
+        finally:
+            self.search_budget = None
+        
+        if budget.exhausted and self.path and len(self.path) > 1 and self.path[-1] != destination \
+                and not self.critical_battery:
+            # Ruta parcial: se completará al acercarse a su final
+            print(f"Robot {self.unique_id}: Presupuesto de búsqueda agotado, avanzando con ruta parcial")
+            self.partial_destination = destination
+            self.partial_tail = self.path[-1]
         
         # Si sigue sin encontrar ruta, esperar y mantener la ruta anterior
         if not self.path or len(self.path) < 2:
@@ -1386,9 +3295,9 @@ class RobotAgent(Agent):
             return False
         
         # Guardar esta ruta en las alternativas probadas
-        if len(self.alternative_paths_tried) > 3:
-            self.alternative_paths_tried.pop(0)  # Eliminar la más antigua
-        self.alternative_paths_tried.append([tuple(pos) for pos in self.path])
+        self.alternative_paths_tried[self.path.fingerprint()] = True
+        if len(self.alternative_paths_tried) > 4:
+            self.alternative_paths_tried.popitem(last=False)  # Eliminar la más antigua
         
         # Resetear contadores
         self.blocked_count = 0
@@ -1472,11 +3381,10 @@ class RobotAgent(Agent):
             
             # Determinar si hay otros robots en la estación o cerca de ella
             robots_at_station = False
-            for robot in self.model.robots:
-                if robot.unique_id != self.unique_id and robot.pos == station_pos:
-                    robots_at_station = True
-                    print(f"Robot {self.unique_id}: Estación ocupada por Robot {robot.unique_id}")
-                    break
+            robot = self.model.robot_at(station_pos, exclude=self)
+            if robot is not None:
+                robots_at_station = True
+                print(f"Robot {self.unique_id}: Estación ocupada por Robot {robot.unique_id}")
             
             # Si llevamos esperando demasiado tiempo o la batería está crítica, buscar otra estación
             if self.position_unchanged_count > 5 or self.battery_level < self.max_battery * 0.1:
@@ -1525,11 +3433,7 @@ class RobotAgent(Agent):
                             if 0 <= point[0] < self.model.grid.width and 0 <= point[1] < self.model.grid.height:
                                 if not self.model.has_obstacle(point):
                                     # Verificar si hay un robot en esta posición
-                                    has_robot = False
-                                    for robot in self.model.robots:
-                                        if robot.unique_id != self.unique_id and robot.pos == point:
-                                            has_robot = True
-                                            break
+                                    has_robot = self.model.robot_at(point, exclude=self) is not None
                                     
                                     if not has_robot:
                                         # Calcular distancia desde nuestra posición
@@ -1564,7 +3468,7 @@ class RobotAgent(Agent):
             # Si la estación está ocupada pero no hemos esperado demasiado, seguir esperando
             elif robots_at_station:
                 # Si no estamos en la cola, intentar añadirnos
-                if self.unique_id not in self.charging_station_target.waiting_queue:
+                if not self.charging_station_target.contains(self.unique_id):
                     self.charging_station_target.add_to_queue(self.unique_id)
                     print(f"Robot {self.unique_id}: Añadido a cola de espera de estación {station_pos}")
                 
@@ -1583,70 +3487,32 @@ class RobotAgent(Agent):
         """Verifica si una ruta ya fue probada anteriormente"""
         if not path:
             return False
-        
-        path_tuples = [tuple(pos) for pos in path]
-        
-        for tried_path in self.alternative_paths_tried:
-            if len(tried_path) == len(path_tuples):
-                matches = True
-                for i in range(len(tried_path)):
-                    if tried_path[i] != path_tuples[i]:
-                        matches = False
-                        break
-                if matches:
-                    return True
-        
-        return False
+        if not isinstance(path, RobotPath):
+            path = RobotPath(path, self.model.grid.height)
+        return path.fingerprint() in self.alternative_paths_tried
 
     def astar_with_robot_penalty(self, start, goal, penalty_multiplier=1.0):
         """A* con penalización adicional por celdas cercanas a robots"""
-        def heuristic(a, b):
-            return abs(a[0] - b[0]) + abs(a[1] - b[1])
-        
         # Crear un mapa de penalizaciones basado en posiciones de robots
         robot_penalty_map = {}
-        for robot in self.model.robots:
-            if robot.unique_id != self.unique_id:
+        for robot_pos, robots in self.model.robot_positions.items():
+            if any(robot is not self for robot in robots):
                 # Penalizar la posición del robot
-                robot_penalty_map[robot.pos] = 10 * penalty_multiplier
+                robot_penalty_map[robot_pos] = 10 * penalty_multiplier
                 
                 # Penalizar posiciones adyacentes
                 for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                    pos = (robot.pos[0] + dx, robot.pos[1] + dy)
+                    pos = (robot_pos[0] + dx, robot_pos[1] + dy)
                     if 0 <= pos[0] < self.model.grid.width and 0 <= pos[1] < self.model.grid.height:
                         robot_penalty_map[pos] = robot_penalty_map.get(pos, 0) + 5 * penalty_multiplier
         
-        open_set = [start]
-        came_from = {}
-        g_score = {start: 0}
-        f_score = {start: heuristic(start, goal)}
+        # Costo base 1 más la penalización si la posición está cerca de robots
+        def move_cost(pos):
+            return self.model.congestion_cost(pos) + robot_penalty_map.get(pos, 0)
         
-        while open_set:
-            current = min(open_set, key=lambda x: f_score.get(x, float('inf')))
-            if current == goal:
-                return self.reconstruct_path(came_from, current)
-            
-            open_set.remove(current)
-            
-            for d in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
-                neighbor = (current[0] + d[0], current[1] + d[1])
-                
-                if 0 <= neighbor[0] < self.model.grid.width and 0 <= neighbor[1] < self.model.grid.height:
-                    if not self.model.has_obstacle(neighbor):
-                        # Base cost
-                        move_cost = 1
-                        
-                        # Additional penalty if position is near robots
-                        move_cost += robot_penalty_map.get(neighbor, 0)
-                        
-                        tentative_g_score = g_score[current] + move_cost
-                        if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                            came_from[neighbor] = current
-                            g_score[neighbor] = tentative_g_score
-                            f_score[neighbor] = tentative_g_score + heuristic(neighbor, goal)
-                            if neighbor not in open_set:
-                                open_set.append(neighbor)
-        return []
+        # Las penalizaciones solo suman coste: la heurística ALT sigue siendo admisible
+        return self.make_search(move_cost=move_cost,
+                                heuristic=self.model.get_heuristic(goal)).search(start, goal)
     
     def find_path_with_detour(self, start, goal):
         """Busca un camino con desvío para evitar bloqueos"""
@@ -1667,27 +3533,21 @@ class RobotAgent(Agent):
             detour_points.append((start[0] + 3, start[1]))
             detour_points.append((start[0] - 3, start[1]))
         
-        # Añadir algunos puntos aleatorios
-        import random
-        for _ in range(2):
-            random_dx = random.randint(-5, 5)
-            random_dy = random.randint(-5, 5)
-            detour_points.append((start[0] + random_dx, start[1] + random_dy))
+        # Añadir los cruces cercanos menos congestionados
+        detour_points.extend(self.model.rank_detour_waypoints(start, goal, 2, max_distance=5))
         
         # Filtrar puntos fuera de los límites o con obstáculos
         valid_detour_points = []
         for point in detour_points:
-            if (0 <= point[0] < self.model.grid.width and 
-                0 <= point[1] < self.model.grid.height and
-                not self.model.has_obstacle(point)):
+            if not self.model.has_obstacle(point):
                 valid_detour_points.append(point)
         
         # Intentar encontrar un camino con desvío
         for detour_point in valid_detour_points:
             # Camino hasta el punto de desvío
             path_to_detour = self.astar(start, detour_point)
-            if not path_to_detour:
-                continue
+            if not path_to_detour or path_to_detour[-1] != detour_point:
+                continue  # Sin ruta, o ruta parcial por presupuesto agotado
                 
             # Camino desde el desvío hasta la meta
             path_from_detour = self.astar(detour_point, goal)
@@ -1705,15 +3565,74 @@ class RobotAgent(Agent):
     
 
 class PathFindingModel(Model):
-    def __init__(self, width, height, robot_configs, charging_station_positions=None):
+    def __init__(self, width, height, robot_configs, charging_station_positions=None,
+                 cooperative_planning=False, planning_window=8, dispatch_planner='individual', seed=None,
+                 flow_field_navigation=False, congestion_weight=0.0, hierarchical_planning=False):
         super().__init__()
+        # Model.__new__ de Mesa ya creó self.random con seed=...; si la semilla llegó por
+        # posición se aplica con reset_randomizer. Los desvíos son reproducibles entre ejecuciones
+        if seed != self._seed:
+            self.reset_randomizer(seed)
         self.grid = MultiGrid(width, height, torus=False)
         self.schedule = BaseScheduler(self)
         self.obstacles = []  # Lista para almacenar los agentes obstáculo
+        # Mapa compacto de celdas bloqueadas (1 = obstáculo), indexado por x * height + y
+        self.obstacle_map = bytearray(width * height)
+        # Máscaras de carril por celda (ver LANE_MOVES); None mientras no haya carriles definidos
+        self.lane_map = None
+        self.jump_point_search = JumpPointSearch(width, height, self.obstacle_map)
+        # Grafo jerárquico (HPA*) opcional y solo en mapas grandes; las rutas largas de los
+        # robots se refinan por tramos. Sus rutas no son siempre óptimas, así que nunca se usa
+        # para las rutas estáticas (caché, comprobaciones de batería)
+        self.hierarchical_min_cells = 4000
+        self.refine_ahead_clusters = 3  # Clusters detallados por delante del robot
+        self.hierarchical_planner = None
+        if hierarchical_planning and width * height >= self.hierarchical_min_cells:
+            self.hierarchical_planner = HierarchicalPlanner(width, height, self.obstacle_map)
         self.robots = []  # Lista para almacenar los robots
+        self.robots_by_id = {}  # Índice unique_id -> robot
+        self.robot_positions = {}  # Índice posición -> robots en la celda, actualizado en cada movimiento
         self.charging_stations = []  # Lista para almacenar las estaciones de carga
-        self.packages = []  # Lista de todos los paquetes
-        self.delivered_packages = []  # Lista de paquetes entregados
+        self.stations_by_pos = {}  # Índice posición -> estación de carga
+        self.packages = PackageStore()  # Tabla columnar con todos los paquetes, indexada por estado
+        self.delivered_packages = PackageRows(self.packages)  # Paquetes entregados, en orden de entrega
+        self.distance_fields = {}  # Campos de distancia por destino fijo (camiones, entregas, estaciones)
+        self.wavefronts = {}  # Destino -> (versión del mapa, distancias hasta él), compartido por los robots
+        # Con campos de flujo los robots hacia destinos fijos solo leen el paso siguiente de su celda.
+        # La planificación cooperativa necesita rutas completas, así que tiene preferencia
+        self.flow_field_navigation = flow_field_navigation and not cooperative_planning
+        self._static_targets = None  # Conjunto de destinos fijos, calculado bajo demanda
+        self._junctions = None  # (versión del mapa, cruces de pasillo) para desvíos
+        self.landmarks = LandmarkHeuristic(width, height, self.obstacle_map)  # Heurística ALT para el resto de metas
+        self.bidirectional_min_distance = 20  # Distancia Manhattan a partir de la que se usa BFS bidireccional
+        
+        # Caché LRU de rutas que solo evitan obstáculos: (inicio, meta, versión del mapa) -> ruta
+        self.map_version = 0  # Se incrementa con cada obstáculo o carril nuevo
+        self.path_cache = OrderedDict()
+        self.path_cache_size = 1024
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
+        self.path_cache_evictions = 0
+        
+        # Planificación cooperativa con ventana (WHCA*): los robots reservan (celda, paso)
+        self.cooperative_planning = cooperative_planning
+        self.planning_window = planning_window
+        self.reservations = ReservationTable()
+        self.cooperative_planner = CooperativePlanner(width, height, self.obstacle_map,
+                                                      self.reservations, planning_window)
+        
+        # Mapa de calor de atascos; con peso > 0 los planificadores lo usan como coste suave
+        self.congestion = CongestionMap(width, height)
+        self.congestion_weight = congestion_weight
+        
+        # Presupuesto de cada replanificación por bloqueo (find_alternative_route)
+        self.replan_max_expansions = 1500
+        self.replan_time_budget = 0.01  # Segundos
+        
+        # Planificador para asignaciones simultáneas: 'individual' (A* por robot) o 'cbs'
+        self.dispatch_planner = dispatch_planner
+        self.cbs_node_budget = 200  # Nodos del árbol de restricciones
+        self.cbs_time_budget = 0.05  # Segundos por lote
         self.next_package_id = 1  # ID para el siguiente paquete
         
         # Crear y registrar las estaciones de carga (no son agentes)
@@ -1724,6 +3643,7 @@ class PathFindingModel(Model):
                     
                 station = ChargingStation(pos)
                 self.charging_stations.append(station)
+                self.stations_by_pos[pos] = station
         
         # Crear y colocar los robots
         robot_id = 1
@@ -1745,8 +3665,9 @@ class PathFindingModel(Model):
                 battery_level=battery_level
             )
             self.robots.append(robot)
+            self.robots_by_id[robot.unique_id] = robot
             self.schedule.add(robot)
-            self.grid.place_agent(robot, tuple(start) if isinstance(start, list) else start)
+            self.place_robot(robot, tuple(start) if isinstance(start, list) else start)
             robot_id += 1
         
         # Añadir recolector de datos para estadísticas
@@ -1765,14 +3686,13 @@ class PathFindingModel(Model):
     
     def create_package(self, pickup_location, delivery_location):
         """Crea un nuevo paquete"""
-        package = Package(self.next_package_id, pickup_location, delivery_location)
+        package = self.packages.create(self.next_package_id, pickup_location, delivery_location)
         self.next_package_id += 1
-        self.packages.append(package)
         return package
 
-    def get_available_packages(self):
-        """Retorna los paquetes disponibles para asignación"""
-        return [p for p in self.packages if p.status == 'waiting']
+    def get_available_packages(self, limit=None):
+        """Retorna los paquetes disponibles para asignación (los limit que más llevan esperando)"""
+        return self.packages.with_status('waiting', limit)
     
     def get_truck_positions(self):
         """Retorna una lista de todas las posiciones de los camiones (a implementar en server.py)"""
@@ -1786,8 +3706,8 @@ class PathFindingModel(Model):
     
     def assign_package_to_robot(self, package_id, robot_id):
         """Asigna un paquete a un robot específico"""
-        package = next((p for p in self.packages if p.id == package_id), None)
-        robot = next((r for r in self.robots if r.unique_id == robot_id), None)
+        package = self.packages.get(package_id)
+        robot = self.get_robot(robot_id)
         
         if not package or not robot:
             return False
@@ -1800,17 +3720,309 @@ class PathFindingModel(Model):
         robot.idle = False
         return True
         
-    def has_obstacle(self, pos):
-        """Comprueba si hay un obstáculo en la posición dada"""
-        # Asegurar que pos sea una tupla
-        if isinstance(pos, list):
-            pos = tuple(pos)
+    def assign_packages_batch(self, assignments):
+        """
+        Asigna varios paquetes en el mismo tick.
+        
+        Cada robot planifica primero su ruta individual; con dispatch_planner = 'cbs'
+        las rutas del lote se sustituyen después por una solución conjunta sin conflictos.
+        
+        Args:
+            assignments: lista de pares (package_id, robot_id)
             
-        cell_contents = self.grid.get_cell_list_contents(pos)
-        for agent in cell_contents:
-            if isinstance(agent, ObstacleAgent):
-                return True
-        return False
+        Returns:
+            list: robots a los que se asignó un paquete
+        """
+        assigned_robots = []
+        for package_id, robot_id in assignments:
+            if self.assign_package_to_robot(package_id, robot_id):
+                assigned_robots.append(self.get_robot(robot_id))
+        
+        if self.dispatch_planner == 'cbs' and len(assigned_robots) > 1:
+            self.plan_batch_paths(assigned_robots)
+        return assigned_robots
+    
+    def plan_batch_paths(self, robots):
+        """
+        Planifica juntas las rutas de varios robots con CBS.
+        
+        Los robots cuya meta comparte otro robot del lote (por ejemplo, el mismo
+        camión) o está ocupada por un robot detenido no tienen solución en CBS:
+        se quedan fuera y conservan sus rutas individuales.
+        
+        Returns:
+            bool: True si se aplicó la solución conjunta, False si no hubo nada que
+            coordinar o CBS falló y se conservan las rutas individuales
+        """
+        batch_ids = set(robot.unique_id for robot in robots)
+        # Los robots detenidos fuera del lote son obstáculos durante la planificación
+        stopped = [robot.pos for robot in self.robots
+                   if robot.unique_id not in batch_ids and (robot.idle or robot.charging)]
+        
+        goal_counts = {}
+        for robot in robots:
+            goal_counts[robot.goal] = goal_counts.get(robot.goal, 0) + 1
+        excluded = [robot for robot in robots if goal_counts[robot.goal] > 1 or robot.goal in stopped]
+        if excluded:
+            print(f"CBS: los robots {[robot.unique_id for robot in excluded]} comparten meta o la tienen "
+                  f"ocupada. Mantienen sus rutas individuales.")
+            robots = [robot for robot in robots if robot not in excluded]
+        if len(robots) < 2:
+            return False
+        
+        agents = {}
+        for robot in robots:
+            agents[robot.unique_id] = (robot.pos, robot.goal, self.get_heuristic(robot.goal))
+        
+        solver = ConflictBasedSearch(self.grid.width, self.grid.height, self.obstacle_map, stopped,
+                                     self.cbs_node_budget, self.cbs_time_budget, self.lane_map)
+        paths = solver.solve(agents)
+        if paths is None:
+            print(f"CBS: {solver.failure}. Se mantienen las rutas individuales.")
+            return False
+        
+        for robot in robots:
+            robot.path = paths[robot.unique_id]
+            robot.timed_path = True  # Las esperas repetidas forman parte del plan
+        print(f"CBS: {len(robots)} rutas sin conflictos ({solver.nodes_expanded} nodos)")
+        return True
+    
+    def place_robot(self, robot, pos):
+        """Coloca un robot en el grid y lo registra en el índice de posiciones"""
+        self.grid.place_agent(robot, pos)
+        self.robot_positions.setdefault(pos, []).append(robot)
+    
+    def move_robot(self, robot, pos):
+        """Mueve un robot en el grid manteniendo actualizado el índice de posiciones"""
+        old_pos = robot.pos
+        self.grid.move_agent(robot, pos)
+        # MultiGrid admite varios robots por celda: solo se quita este de la celda anterior
+        robots = self.robot_positions.get(old_pos)
+        if robots is not None and robot in robots:
+            robots.remove(robot)
+            if not robots:
+                del self.robot_positions[old_pos]
+        self.robot_positions.setdefault(pos, []).append(robot)
+    
+    def robots_at(self, pos):
+        """Devuelve los robots que ocupan la posición dada (consulta O(1))"""
+        return self.robot_positions.get(pos, [])
+    
+    def robot_at(self, pos, exclude=None):
+        """Devuelve un robot de la posición dada distinto de exclude, o None (consulta O(1))"""
+        for robot in self.robot_positions.get(pos, ()):
+            if robot is not exclude:
+                return robot
+        return None
+    
+    def get_robot(self, robot_id):
+        """Devuelve el robot con ese unique_id, o None (consulta O(1))"""
+        return self.robots_by_id.get(robot_id)
+    
+    def get_station_at(self, pos):
+        """Devuelve la estación de carga en la posición dada, o None (consulta O(1))"""
+        return self.stations_by_pos.get(pos)
+    
+    def robots_near(self, pos, radius):
+        """Devuelve los robots a distancia Manhattan <= radius de pos"""
+        nearby = []
+        for dx in range(-radius, radius + 1):
+            span = radius - abs(dx)
+            for dy in range(-span, span + 1):
+                nearby.extend(self.robot_positions.get((pos[0] + dx, pos[1] + dy), ()))
+        return nearby
+    
+    def get_static_targets(self):
+        """Destinos fijos del almacén: camiones, puntos de entrega y estaciones de carga"""
+        if self._static_targets is None:
+            targets = set(station.pos for station in self.charging_stations)
+            for positions in (self.get_truck_positions(), self.get_delivery_positions()):
+                if positions:
+                    targets.update(tuple(pos) for pos in positions)
+            self._static_targets = targets
+        return self._static_targets
+    
+    def get_distance_field(self, target):
+        """Devuelve (creándolo si hace falta) el campo de distancias de un destino fijo, o None"""
+        field = self.distance_fields.get(target)
+        if field is None and target in self.get_static_targets():
+            field = DistanceField(target, self.grid.width, self.grid.height, self.obstacle_map, self.lane_map)
+            self.distance_fields[target] = field
+        return field
+    
+    def get_wavefront(self, target):
+        """Matriz de distancias reales de cada celda hasta target; se recalcula al cambiar el mapa"""
+        cached = self.wavefronts.get(target)
+        if cached is None or cached[0] != self.map_version:
+            distances = wavefront_distances(self.obstacle_map, self.grid.width, self.grid.height, target,
+                                            self.lane_map, toward_source=True)
+            cached = self.wavefronts[target] = (self.map_version, distances)
+        return cached[1]
+    
+    def get_heuristic(self, goal):
+        """Heurística para buscar hacia goal: distancia exacta si hay campo, ALT si no"""
+        field = self.get_distance_field(goal)
+        return field.heuristic if field is not None else self.landmarks.heuristic
+    
+    def precompute_distance_fields(self):
+        """Construye por adelantado los campos de todos los destinos fijos"""
+        for target in self.get_static_targets():
+            self.get_distance_field(target)
+    
+    def find_static_path(self, start, goal):
+        """Ruta más corta evitando solo obstáculos (ignora robots), con caché LRU"""
+        key = (start, goal, self.map_version)
+        path = self.path_cache.get(key)
+        if path is not None:
+            self.path_cache_hits += 1
+            self.path_cache.move_to_end(key)
+            return list(path)  # Copia: los robots consumen sus rutas
+        
+        self.path_cache_misses += 1
+        path = self.compute_static_path(start, goal)
+        self.path_cache[key] = tuple(path)
+        if len(self.path_cache) > self.path_cache_size:
+            self.path_cache.popitem(last=False)
+            self.path_cache_evictions += 1
+        return path
+    
+    def get_path_cache_stats(self):
+        """Contadores de la caché de rutas estáticas"""
+        return {
+            'size': len(self.path_cache),
+            'hits': self.path_cache_hits,
+            'misses': self.path_cache_misses,
+            'evictions': self.path_cache_evictions,
+            'map_version': self.map_version
+        }
+    
+    def compute_static_path(self, start, goal):
+        """Calcula la ruta estática sin pasar por la caché (siempre una ruta más corta)"""
+        field = self.get_distance_field(goal)
+        if field is not None:
+            if not self.has_obstacle(start):
+                return field.path_from(start)
+        elif not self.has_obstacle(start) and self.lane_map is None:
+            # Sin penalizaciones dinámicas ni carriles: Jump Point Search (mismas longitudes que A*)
+            return self.jump_point_search.search(start, goal)
+        # Inicio sobre un obstáculo o mapa con carriles: ni el campo ni JPS lo cubren
+        return AStarSearch(self.grid.width, self.grid.height, self.obstacle_map,
+                           heuristic=self.get_heuristic(goal), lane_map=self.lane_map).search(start, goal)
+    
+    def get_hierarchical_planner(self, start, goal):
+        """Planificador HPA* si la ruta es larga y el destino no tiene campo de distancias, o None"""
+        planner = self.hierarchical_planner
+        # El grafo abstracto supone pasillos de doble sentido: con carriles no se usa
+        if planner is None or self.lane_map is not None or goal in self.distance_fields or \
+                goal in self.get_static_targets():
+            return None
+        if manhattan(start, goal) <= 2 * planner.cluster_size or self.has_obstacle(start):
+            return None
+        return planner
+    
+    def get_junction_waypoints(self):
+        """Cruces de pasillo: celdas libres con salida horizontal y vertical y al menos 3 vecinos libres"""
+        if self._junctions is None or self._junctions[0] != self.map_version:
+            junctions = []
+            for x in range(self.grid.width):
+                for y in range(self.grid.height):
+                    if self.has_obstacle((x, y)):
+                        continue
+                    horizontal = sum(not self.has_obstacle((x + dx, y)) for dx in (-1, 1))
+                    vertical = sum(not self.has_obstacle((x, y + dy)) for dy in (-1, 1))
+                    if horizontal and vertical and horizontal + vertical >= 3:
+                        junctions.append((x, y))
+            self._junctions = (self.map_version, junctions)
+        return self._junctions[1]
+    
+    def rank_detour_waypoints(self, origin, goal, count, max_distance=None):
+        """Cruces candidatos para un desvío: primero los menos congestionados y los que menos alargan la ruta"""
+        # Robots en un radio de 2 alrededor de cada celda, calculado una vez por consulta
+        congestion = {}
+        for robot_pos, robots in self.robot_positions.items():
+            for dx in range(-2, 3):
+                for dy in range(-2 + abs(dx), 3 - abs(dx)):
+                    cell = (robot_pos[0] + dx, robot_pos[1] + dy)
+                    congestion[cell] = congestion.get(cell, 0) + len(robots)
+        
+        candidates = []
+        for point in self.get_junction_waypoints():
+            distance = manhattan(origin, point)
+            if distance == 0 or (max_distance is not None and distance > max_distance):
+                continue
+            # El generador del modelo solo desempata, de forma reproducible
+            candidates.append((congestion.get(point, 0), distance + manhattan(point, goal),
+                               self.random.random(), point))
+        candidates.sort()
+        return [point for _, _, _, point in candidates[:count]]
+    
+    def congestion_cost(self, pos):
+        """Coste de entrar en pos: 1 más la congestión reciente ponderada"""
+        if not self.congestion_weight:
+            return 1
+        return 1 + self.congestion_weight * self.congestion.value(pos)
+    
+    def set_lanes(self, lanes):
+        """Define carriles de sentido único.
+
+        Args:
+            lanes: iterable de (pos, direcciones), con direcciones una lista de
+                movimientos (dx, dy) permitidos al salir de pos; vacía = sin restricción
+        Returns:
+            int: número de celdas cuyo carril cambió
+        Raises:
+            ValueError: si alguna dirección no es un movimiento cardinal; en ese caso
+                no se aplica ningún carril
+        """
+        width, height = self.grid.width, self.grid.height
+        masks = []
+        for pos, directions in lanes:
+            x, y = pos
+            if not (0 <= x < width and 0 <= y < height):
+                continue
+            mask = 0
+            for direction in directions:
+                move = tuple(direction) if isinstance(direction, (list, tuple)) else None
+                if move not in MOVES:
+                    raise ValueError(f"Dirección de carril desconocida en {tuple(pos)}: {direction!r}")
+                mask |= 1 << MOVES.index(move)
+            masks.append((x, y, mask))
+        
+        changed = 0
+        for x, y, mask in masks:
+            if self.lane_map is None:
+                if not mask:
+                    continue
+                self.lane_map = bytearray(width * height)
+            if self.lane_map[x * height + y] != mask:
+                self.lane_map[x * height + y] = mask
+                changed += 1
+        
+        if changed:
+            self.map_version += 1  # Las rutas en caché pueden ir contra el nuevo sentido
+            self.cooperative_planner.lane_map = self.lane_map
+            for field in self.distance_fields.values():
+                field.lane_map = self.lane_map
+                field.build()
+        return changed
+    
+    def can_move(self, origin, target):
+        """El carril de origin permite el paso a la celda vecina target (esperar siempre está permitido)"""
+        if self.lane_map is None or origin == target:
+            return True
+        direction = (target[0] - origin[0], target[1] - origin[1])
+        if direction not in MOVES:
+            return True
+        lanes = self.lane_map[origin[0] * self.grid.height + origin[1]]
+        return not lanes or bool(lanes & (1 << MOVES.index(direction)))
+    
+    def has_obstacle(self, pos):
+        """Comprueba si hay un obstáculo en la posición dada (consulta O(1) al mapa de bits)"""
+        x, y = pos
+        # Fuera del grid se considera bloqueado
+        if not (0 <= x < self.grid.width and 0 <= y < self.grid.height):
+            return True
+        return self.obstacle_map[x * self.grid.height + y] == 1
     
     def add_obstacle(self, pos):
         """Añade un obstáculo en la posición especificada"""
@@ -1824,9 +4036,8 @@ class PathFindingModel(Model):
                 return False
         
         # Verificar que no sea una estación de carga
-        for station in self.charging_stations:
-            if pos == station.pos:
-                return False
+        if self.get_station_at(pos):
+            return False
                 
         if not self.has_obstacle(pos):
             
@@ -1835,10 +4046,22 @@ class PathFindingModel(Model):
             self.obstacles.append(obstacle)
             self.schedule.add(obstacle)
             self.grid.place_agent(obstacle, pos)
+            self.obstacle_map[pos[0] * self.grid.height + pos[1]] = 1
+            self.map_version += 1  # Las rutas en caché de versiones anteriores dejan de usarse
+            self.jump_point_search.invalidate(pos)
+            if self.hierarchical_planner is not None:
+                self.hierarchical_planner.mark_dirty(pos)
+            # Reparar solo la parte afectada de cada campo de distancias
+            for field in self.distance_fields.values():
+                field.block_cell(pos)
+            self.landmarks.block_cell(pos)
             
-            # Recalcular la ruta de todos los robots
+            # Reparar solo las rutas que atraviesan el nuevo obstáculo
             for robot in self.robots:
-                if not robot.reached_goal and robot.path:
+                if robot.in_flow_mode():
+                    continue  # Lee el campo ya reparado en su próximo paso
+                if not robot.reached_goal and robot.path and not robot.repair_path(pos):
+                    # No se pudo reparar localmente: replanificar la ruta completa
                     if robot.charging and robot.nearest_charging_station:
                         # Si se está dirigiendo a una estación de carga, recalcular esa ruta
                         robot.path = robot.calculate_path_to_station(robot.nearest_charging_station)
@@ -1861,13 +4084,15 @@ class PathFindingModel(Model):
             return False
             
         # Verificar que no hay otra estación de carga en la misma posición
-        for station in self.charging_stations:
-            if station.pos == pos:
-                return False
+        if self.get_station_at(pos):
+            return False
                 
         
         station = ChargingStation(pos)
         self.charging_stations.append(station)
+        self.stations_by_pos[pos] = station
+        # La nueva estación es un destino fijo más; su campo se crea al primer uso
+        self._static_targets = None
         
         return True
     
@@ -1895,8 +4120,49 @@ class PathFindingModel(Model):
                 if hasattr(robot, 'priority'):
                     robot.priority += 5
     
+    def plan_cooperative_window(self):
+        """
+        Planifica sin conflictos los próximos pasos de los robots en movimiento.
+        
+        Los robots detenidos reservan su celda durante toda la ventana; los demás se
+        planifican por prioridad con A* cooperativo y su ruta pasa a ser el plan de la
+        ventana seguido del resto de la ruta hacia su destino.
+        """
+        self.reservations.clear()
+        horizon = self.planning_window + 1
+        
+        moving_robots = []
+        for robot in self.robots:
+            if robot.idle or robot.charging or not robot.path or len(robot.path) <= 1:
+                self.reservations.reserve_path([robot.pos], robot.unique_id, horizon)
+            else:
+                # Ocupa su celda al menos hasta que se planifique su movimiento
+                self.reservations.reserve_path([robot.pos], robot.unique_id, 1)
+                moving_robots.append(robot)
+        
+        moving_robots.sort(key=lambda r: (-r.priority, r.unique_id))
+        for robot in moving_robots:
+            destination = robot.path[-1]
+            plan = self.cooperative_planner.plan(robot.unique_id, robot.pos, destination,
+                                                 self.get_heuristic(destination))
+            if not plan:
+                continue  # Sin plan libre: el control reactivo de bloqueos se encarga
+            self.reservations.reserve_path(plan, robot.unique_id, horizon)
+            
+            end = plan[-1]
+            if end == destination:
+                robot.path = plan
+            elif end in robot.path:
+                robot.path = plan + robot.path[robot.path.index(end) + 1:]
+            else:
+                robot.path = plan + self.find_static_path(end, destination)[1:]
+            robot.timed_path = True  # Las esperas de la ventana forman parte del plan
+    
     def step(self):
+        self.congestion.tick()
         self.check_robots_health()
+        if self.cooperative_planning:
+            self.plan_cooperative_window()
         self.datacollector.collect(self)
         self.schedule.step()
     
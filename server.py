@@ -12,7 +12,6 @@ import time
 import tempfile
 import datetime
 import json
-import random
 import threading
 from flask import Flask, render_template, request, send_file
 from flask_socketio import SocketIO, emit
@@ -136,6 +135,8 @@ def handle_connect():
     # Enviar estado actual si el modelo ya está inicializado
     if model:
         emit_state()
+        # Los paquetes van por deltas: el cliente nuevo necesita la lista completa
+        emit_packages_update(full=True, to=request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -215,6 +216,7 @@ def handle_initialize(data):
     ]
     charging_stations_config = data.get('charging_stations', [])
     obstacles_list = data.get('obstacles', [])  
+    lanes_list = data.get('lanes', [])  # Carriles: {x, y, directions: [[dx, dy], ...]}
     
     # Asegurar que todos los robots tengan configuración de inicio y meta
     for i, robot in enumerate(robots_config):
@@ -223,7 +225,15 @@ def handle_initialize(data):
             return
     
     # Inicializar el modelo con múltiples robots y estaciones de carga
-    model = PathFindingModel(width, height, robots_config, charging_stations_config)
+    model = PathFindingModel(width, height, robots_config, charging_stations_config,
+                             cooperative_planning=data.get('cooperative_planning', False),
+                             dispatch_planner=data.get('dispatch_planner', 'individual'),
+                             seed=data.get('seed'),
+                             flow_field_navigation=data.get('flow_field_navigation', False),
+                             congestion_weight=data.get('congestion_weight', 0.0),
+                             hierarchical_planning=data.get('hierarchical_planning', False))
+    # packages_update solo envía los paquetes que cambian desde la última emisión
+    model.packages.track_changes()
     
     # Garantizar que el contador de pasos comience en 0
     model.schedule.steps = 0
@@ -243,6 +253,21 @@ def handle_initialize(data):
             if model.add_obstacle((x, y)):
                 obstacles.append({'x': x, 'y': y})
     
+    # Carriles de sentido único, antes de construir los campos de distancia
+    lanes = []
+    for lane in lanes_list:
+        if isinstance(lane, dict):
+            lanes.append(((lane.get('x', 0), lane.get('y', 0)), lane.get('directions', [])))
+    try:
+        model.set_lanes(lanes)
+    except ValueError as error:
+        model = None  # No dejar en marcha un modelo con los carriles a medias
+        emit('error', {'message': str(error)})
+        return
+    
+    # Precalcular los campos de distancia a camiones, entregas y estaciones
+    model.precompute_distance_fields()
+    
     # Guardar posiciones de las estaciones de carga
     charging_stations = []
     for station in model.charging_stations:
@@ -256,7 +281,7 @@ def handle_initialize(data):
             'start': {'x': robot.start[0], 'y': robot.start[1]},
             'goal': {'x': robot.goal[0], 'y': robot.goal[1]},
             'position': {'x': robot.pos[0], 'y': robot.pos[1]},
-            'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path],
+            'path': robot.path.to_flat(),
             'color': robot.color,
             'battery_level': robot.battery_level,
             'max_battery': robot.max_battery,
@@ -288,8 +313,8 @@ def generate_initial_packages(count):
     print(f"Generando {count} paquetes...")
     packages_created = []
     for _ in range(count):
-        truck_pos = random.choice(truck_positions)
-        delivery_pos = random.choice(delivery_positions)
+        truck_pos = model.random.choice(truck_positions)
+        delivery_pos = model.random.choice(delivery_positions)
         package = model.create_package(truck_pos, delivery_pos)
         packages_created.append({
             'id': package.id,
@@ -305,6 +330,9 @@ def generate_initial_packages(count):
         'total_created': count
     })
     
+    # Los clientes descartan los paquetes de un modelo anterior
+    emit_packages_update(full=True)
+    
     # Intentar asignar paquetes a todos los robots inicialmente
     assign_packages_to_available_robots()
 
@@ -322,33 +350,33 @@ def assign_packages_to_available_robots():
     if not available_robots:
         return
     
-    # Obtener paquetes disponibles
-    available_packages = model.get_available_packages()
+    # Obtener paquetes disponibles (solo hacen falta tantos como robots libres)
+    available_packages = model.get_available_packages(len(available_robots))
     
     if not available_packages:
         return
     
-    print(f"Asignando paquetes: {len(available_packages)} disponibles, {len(available_robots)} robots libres")
+    print(f"Asignando paquetes: {model.packages.count('waiting')} disponibles, {len(available_robots)} robots libres")
     
-    # Asignar paquetes a robots disponibles
-    assignments_made = 0
-    for i in range(min(len(available_robots), len(available_packages))):
-        robot = available_robots[i]
-        package = available_packages[i]
+    # Asignar paquetes a robots disponibles (en lote, para que el modelo pueda planificarlos juntos)
+    assignments = [(available_packages[i].id, available_robots[i].unique_id)
+                   for i in range(min(len(available_robots), len(available_packages)))]
+    assigned_robots = model.assign_packages_batch(assignments)
+    assignments_made = len(assigned_robots)
+    
+    for robot in assigned_robots:
+        package = robot.carrying_package
+        print(f"Paquete {package.id} asignado al robot {robot.unique_id}")
         
-        if model.assign_package_to_robot(package.id, robot.unique_id):
-            assignments_made += 1
-            print(f"Paquete {package.id} asignado al robot {robot.unique_id}")
-            
-            # Emitir evento de asignación para este paquete específico
-            socketio.emit('package_assigned', {
-                'package_id': package.id,
-                'robot': {
-                    'id': robot.unique_id,
-                    'goal': {'x': robot.goal[0], 'y': robot.goal[1]},
-                    'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path]
-                }
-            })
+        # Emitir evento de asignación para este paquete específico
+        socketio.emit('package_assigned', {
+            'package_id': package.id,
+            'robot': {
+                'id': robot.unique_id,
+                'goal': {'x': robot.goal[0], 'y': robot.goal[1]},
+                'path': robot.path.to_flat()
+            }
+        })
     
     if assignments_made > 0:
         print(f"Se asignaron {assignments_made} paquetes")
@@ -389,7 +417,7 @@ def handle_change_goal(data):
     goal_y = int(data.get('goal_y', 0))
     
     # Encontrar el robot
-    robot = next((r for r in model.robots if r.unique_id == robot_id), None)
+    robot = model.get_robot(robot_id)
     if not robot:
         emit('error', {'message': f'Robot {robot_id} no encontrado'})
         return
@@ -404,7 +432,7 @@ def handle_change_goal(data):
     emit('goal_changed', {
         'robot_id': robot_id,
         'goal': {'x': goal_x, 'y': goal_y},
-        'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path]
+        'path': robot.path.to_flat()
     })
     
     # También emitir actualización de estado general
@@ -437,7 +465,7 @@ def handle_add_obstacle(data):
             
             robots_paths.append({
                 'id': robot.unique_id,
-                'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path]
+                'path': robot.path.to_flat()
             })
         
         emit('obstacle_added', {
@@ -477,7 +505,7 @@ def handle_add_charging_station(data):
             
             robots_paths.append({
                 'id': robot.unique_id,
-                'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path]
+                'path': robot.path.to_flat()
             })
             
         emit('charging_station_added', {
@@ -501,8 +529,8 @@ def handle_create_packages(data):
     
     packages = []
     for _ in range(count):
-        truck_pos = random.choice(truck_positions)
-        delivery_pos = random.choice(delivery_positions)
+        truck_pos = model.random.choice(truck_positions)
+        delivery_pos = model.random.choice(delivery_positions)
         package = model.create_package(truck_pos, delivery_pos)
         packages.append({
             'id': package.id,
@@ -536,14 +564,14 @@ def handle_assign_package(data):
         emit('error', {'message': 'No se pudo asignar el paquete'})
         return
     
-    robot = next((r for r in model.robots if r.unique_id == robot_id), None)
+    robot = model.get_robot(robot_id)
     
     emit('package_assigned', {
         'package_id': package_id,
         'robot': {
             'id': robot.unique_id,
             'goal': {'x': robot.goal[0], 'y': robot.goal[1]},
-            'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path]
+            'path': robot.path.to_flat()
         }
     })
     
@@ -554,7 +582,7 @@ def handle_assign_package(data):
 @socketio.on('get_packages')
 def handle_get_packages():
     """Retorna información sobre los paquetes"""
-    emit_packages_update()
+    emit_packages_update(full=True)
 
 @socketio.on('get_state')
 def handle_get_state():
@@ -607,15 +635,14 @@ def get_state():
     active_packages = []
     delivered_packages = []
     
-    for package in model.packages:
-        if package.status != 'delivered':
-            active_packages.append({
-                'id': package.id,
-                'pickup': {'x': package.pickup_location[0], 'y': package.pickup_location[1]},
-                'delivery': {'x': package.delivery_location[0], 'y': package.delivery_location[1]},
-                'status': package.status,
-                'assigned_robot_id': package.assigned_robot_id
-            })
+    for package in model.packages.active_packages():
+        active_packages.append({
+            'id': package.id,
+            'pickup': {'x': package.pickup_location[0], 'y': package.pickup_location[1]},
+            'delivery': {'x': package.delivery_location[0], 'y': package.delivery_location[1]},
+            'status': package.status,
+            'assigned_robot_id': package.assigned_robot_id
+        })
     
     for package in model.delivered_packages:
         delivered_packages.append({
@@ -652,7 +679,8 @@ def get_state():
         'total_packages_delivered': len(model.delivered_packages),
         'active_packages': active_packages,
         'delivered_packages': delivered_packages,
-        'delivered_packages_stats': delivered_packages_stats
+        'delivered_packages_stats': delivered_packages_stats,
+        'path_cache': model.get_path_cache_stats()
     }, indent=4), 200
 
 
@@ -672,7 +700,7 @@ def emit_state():
             'start': {'x': robot.start[0], 'y': robot.start[1]},
             'goal': {'x': robot.goal[0], 'y': robot.goal[1]},
             'position': {'x': robot.pos[0], 'y': robot.pos[1]},
-            'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path],
+            'path': robot.path.to_flat(),
             'reached_goal': robot.reached_goal,
             'steps_taken': robot.steps_taken,
             'color': robot.color,
@@ -699,40 +727,14 @@ def emit_state():
         
         robots_info.append(robot_data)
     
-    # Calcular estadísticas de paquetes entregados
+    # Calcular estadísticas de paquetes entregados (reducciones sobre las columnas de la tabla)
     delivered_packages_stats = {
         'count': len(model.delivered_packages),
         'avg_delivery_time': 0,
         'min_delivery_time': 0,
         'max_delivery_time': 0
     }
-    
-    if model.delivered_packages:
-        delivery_times = []
-        assignment_to_pickup_times = []  # Tiempo de asignación a recogida
-        pickup_to_delivery_times = []    # Tiempo de recogida a entrega
-        total_process_times = []         # Tiempo total del proceso
-        for package in model.delivered_packages:
-            if package.assignment_time is not None and package.pickup_time is not None and package.delivery_time is not None:
-                assignment_to_pickup = package.pickup_time - package.assignment_time
-                pickup_to_delivery = package.delivery_time - package.pickup_time
-                total_time = package.delivery_time - package.assignment_time
-                
-                assignment_to_pickup_times.append(assignment_to_pickup)
-                pickup_to_delivery_times.append(pickup_to_delivery)
-                total_process_times.append(total_time)
-        
-        if delivery_times:
-            delivered_packages_stats['avg_delivery_time'] = sum(delivery_times) / len(delivery_times)
-            delivered_packages_stats['min_delivery_time'] = min(delivery_times)
-            delivered_packages_stats['max_delivery_time'] = max(delivery_times)
-
-        if pickup_to_delivery_times:
-            delivered_packages_stats['avg_pickup_to_delivery'] = sum(pickup_to_delivery_times) / len(pickup_to_delivery_times)
-        if assignment_to_pickup_times:
-            delivered_packages_stats['avg_assignment_to_pickup'] = sum(assignment_to_pickup_times) / len(assignment_to_pickup_times)
-        if total_process_times:
-            delivered_packages_stats['avg_total_process'] = sum(total_process_times) / len(total_process_times)
+    delivered_packages_stats.update(model.packages.delivery_stats())
     
     # Calcular tiempo transcurrido desde el inicio de la simulación
     elapsed_time = 0
@@ -751,7 +753,7 @@ def emit_state():
         'charging_stations': charging_stations,
         'all_reached_goal': model.all_robots_reached_goal(),
         'total_packages_delivered': len(model.delivered_packages),
-        'active_packages': len([p for p in model.packages if p.status != 'delivered']),
+        'active_packages': model.packages.count_active(),
         'delivered_packages_stats': delivered_packages_stats,
         'simulation_stats': {
             'elapsed_time': elapsed_time,
@@ -786,7 +788,7 @@ def emit_robots_update():
             'charging': robot.charging,
             'status': 'charging' if robot.charging else 'goal_reached' if robot.reached_goal else 'moving',
             'battery_percentage': (robot.battery_level / robot.max_battery) * 100,
-            'path': [{'x': pos[0], 'y': pos[1]} for pos in robot.path],  # Incluir la ruta actualizada
+            'path': robot.path.to_flat(),  # Incluir la ruta actualizada
             'idle': getattr(robot, 'idle', False),  # Atributo idle
             'is_carrying': robot.carrying_package is not None and robot.carrying_package.status == 'picked'
         })
@@ -796,28 +798,30 @@ def emit_robots_update():
         'all_reached_goal': all_reached_goal
     })
 
-def emit_packages_update():
-    """Emite información actualizada de los paquetes"""
+def emit_packages_update(full=False, to=None):
+    """Emite los paquetes que cambiaron de estado desde la última emisión (o todos si full).
+
+    Con to, la instantánea completa va solo a ese cliente y no consume los cambios
+    pendientes del resto.
+    """
     global model
     
     if model is None:
         return
     
-    active_packages = []
-    delivered_packages = []
-    
-    for package in model.packages:
-        if package.status != 'delivered':
-            active_packages.append({
-                'id': package.id,
-                'pickup': {'x': package.pickup_location[0], 'y': package.pickup_location[1]},
-                'delivery': {'x': package.delivery_location[0], 'y': package.delivery_location[1]},
-                'status': package.status,
-                'assigned_robot_id': package.assigned_robot_id
-            })
+    if full:
+        if to is None:
+            # La instantánea ya incluye los cambios pendientes
+            model.packages.take_changes()
+        packages = model.packages.active_packages() + model.delivered_packages
+    else:
+        packages = model.packages.take_changes()
+        if not packages:
+            return
     
-    for package in model.delivered_packages:
-        delivered_packages.append({
+    changed_packages = []
+    for package in packages:
+        changed_packages.append({
             'id': package.id,
             'pickup': {'x': package.pickup_location[0], 'y': package.pickup_location[1]},
             'delivery': {'x': package.delivery_location[0], 'y': package.delivery_location[1]},
@@ -828,10 +832,10 @@ def emit_packages_update():
         })
     
     socketio.emit('packages_update', {
-        'active_packages': active_packages,
-        'delivered_packages': delivered_packages,
-        'total_delivered': len(delivered_packages)
-    })
+        'full': full,
+        'packages': changed_packages,
+        'total_delivered': len(model.delivered_packages)
+    }, to=to)
 step_counter = 0
 # Función para la automatización de pasos
 def run_simulation_step():
@@ -1385,6 +1389,7 @@ if __name__ == '__main__':
         let chargingStations = [];
         let isRunning = false;
         let activePackages = [];
+        let activePackagesById = new Map();  // id -> paquete activo, actualizado con cada cambio
         let deliveredPackages = [];
         
         // Elementos DOM
@@ -1520,8 +1525,20 @@ if __name__ == '__main__':
         });
         
         socket.on('packages_update', (data) => {
-            activePackages = data.active_packages;
-            deliveredPackages = data.delivered_packages;
+            // Instantánea completa o solo los paquetes que cambiaron de estado
+            if (data.full) {
+                activePackagesById = new Map();
+                deliveredPackages = [];
+            }
+            for (const pkg of data.packages) {
+                if (pkg.status === 'delivered') {
+                    activePackagesById.delete(pkg.id);
+                    deliveredPackages.push(pkg);
+                } else {
+                    activePackagesById.set(pkg.id, pkg);
+                }
+            }
+            activePackages = Array.from(activePackagesById.values());
             updatePackagesUI();
         });
         
@@ -1916,6 +1933,16 @@ if __name__ == '__main__':
         }
         
         // Función para actualizar las rutas en el grid
+        // Las rutas llegan del servidor como lista plana [x0, y0, x1, y1, ...]
+        function decodePath(path) {
+            if (path.length === 0 || typeof path[0] === 'object') return path;
+            const positions = [];
+            for (let i = 0; i + 1 < path.length; i += 2) {
+                positions.push({x: path[i], y: path[i + 1]});
+            }
+            return positions;
+        }
+        
         function updatePaths() {
             // Limpiar las rutas anteriores
             document.querySelectorAll('.cell.path').forEach(cell => {
@@ -1926,7 +1953,7 @@ if __name__ == '__main__':
             robots.forEach(robot => {
                 if (!robot.path || robot.reached_goal) return;
                 
-                robot.path.forEach(pos => {
+                decodePath(robot.path).forEach(pos => {
                     // No mostrar el camino en inicio, meta o posición actual del robot
                     if ((pos.x === robot.start.x && pos.y === robot.start.y) ||
                         (pos.x === robot.goal.x && pos.y === robot.goal.y) ||
@@ -2052,7 +2079,7 @@ if __name__ == '__main__':
             
             // El resto se maneja en los eventos: 'packages_update', 'package_assigned'
             socket.once('packages_update', (data) => {
-                const unassignedPackages = data.active_packages.filter(p => p.status === 'waiting');
+                const unassignedPackages = activePackages.filter(p => p.status === 'waiting');
                 
                 if (unassignedPackages.length === 0) {
                     alert('No hay paquetes pendientes de asignar.');
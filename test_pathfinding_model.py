@@ -0,0 +1,711 @@
+"""Pruebas de los planificadores y estructuras de datos de pathfinding_model"""
+import random
+from collections import deque
+
+import pytest
+
+from pathfinding_model import (AStarSearch, BidirectionalSearch, ChargingStation, ConflictBasedSearch, CongestionMap,
+                               DistanceField, HierarchicalPlanner, JumpPointSearch, LandmarkHeuristic, PackageRows, PackageStore,
+                               PathFindingModel, RobotPath, SearchBudget, manhattan, wavefront_distances)
+
+
+def random_map(width, height, density, seed):
+    """Mapa de obstáculos aleatorio (1 = bloqueado) indexado por x * height + y"""
+    rng = random.Random(seed)
+    return bytearray(1 if rng.random() < density else 0 for _ in range(width * height))
+
+
+def free_cells(blocked_map, width, height):
+    return [(x, y) for x in range(width) for y in range(height) if not blocked_map[x * height + y]]
+
+
+def bfs_distances(blocked_map, width, height, start):
+    """Distancias exactas desde start por BFS (referencia para la optimalidad)"""
+    distances = {start: 0}
+    queue = deque([start])
+    while queue:
+        x, y = queue.popleft()
+        for dx, dy in ((-1, 0), (1, 0), (0, 1), (0, -1)):
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height and not blocked_map[nx * height + ny] \
+                    and (nx, ny) not in distances:
+                distances[(nx, ny)] = distances[(x, y)] + 1
+                queue.append((nx, ny))
+    return distances
+
+
+def assert_valid_path(path, start, goal, blocked_map, height):
+    """Ruta conexa de start a goal, con pasos cardinales y sin atravesar obstáculos"""
+    assert path[0] == start and path[-1] == goal
+    for a, b in zip(path, path[1:]):
+        assert manhattan(a, b) == 1
+    assert not any(blocked_map[x * height + y] for x, y in path)
+
+
+def sample_queries(width, height, blocked_map, seed, count=40):
+    rng = random.Random(seed)
+    cells = free_cells(blocked_map, width, height)
+    return [(rng.choice(cells), rng.choice(cells)) for _ in range(count)]
+
+
+def make_model(width, height, starts, **kwargs):
+    """Modelo con un robot parado en cada posición de starts"""
+    robots = [{'start': list(start), 'goal': list(start)} for start in starts]
+    return PathFindingModel(width, height, robots, **kwargs)
+
+
+def list_astar(width, height, blocked_map, start, goal, move_cost=None):
+    """A* anterior al motor compartido: lista abierta con min() por f, sin conjunto cerrado"""
+    open_set = [start]
+    came_from = {}
+    g_score = {start: 0}
+    f_score = {start: manhattan(start, goal)}
+    while open_set:
+        current = min(open_set, key=lambda x: f_score.get(x, float('inf')))
+        if current == goal:
+            path = [current]
+            while current in came_from:
+                current = came_from[current]
+                path.insert(0, current)
+            return path
+        open_set.remove(current)
+        for d in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
+            neighbor = (current[0] + d[0], current[1] + d[1])
+            if 0 <= neighbor[0] < width and 0 <= neighbor[1] < height \
+                    and not blocked_map[neighbor[0] * height + neighbor[1]]:
+                tentative_g_score = g_score[current] + (1 if move_cost is None else move_cost(neighbor))
+                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    f_score[neighbor] = tentative_g_score + manhattan(neighbor, goal)
+                    if neighbor not in open_set:
+                        open_set.append(neighbor)
+    return []
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_astar_reproduces_list_based_paths(seed):
+    width, height = 30, 20
+    blocked_map = random_map(width, height, 0.25, seed)
+    rng = random.Random(seed)
+    penalties = {cell: rng.choice((0, 0, 5, 10)) for cell in free_cells(blocked_map, width, height)}
+    move_cost = lambda pos: 1 + penalties[pos]
+    plain = AStarSearch(width, height, blocked_map)
+    weighted = AStarSearch(width, height, blocked_map, move_cost=move_cost)
+    for start, goal in sample_queries(width, height, blocked_map, seed):
+        # Mismas rutas, no solo la misma longitud: los empates se resuelven igual
+        assert plain.search(start, goal) == list_astar(width, height, blocked_map, start, goal)
+        assert weighted.search(start, goal) == list_astar(width, height, blocked_map, start, goal, move_cost)
+        expected = bfs_distances(blocked_map, width, height, start).get(goal)
+        path = plain.search(start, goal)
+        assert (len(path) - 1 if path else None) == expected
+        if path:
+            assert_valid_path(path, start, goal, blocked_map, height)
+
+
+def test_obstacle_map_follows_added_obstacles():
+    model = make_model(10, 6, [(0, 0)])
+    assert model.add_obstacle([4, 2]) and not model.add_obstacle((4, 2))
+    assert not model.add_obstacle((0, 0))  # Posición de un robot
+    assert model.obstacle_map[4 * 6 + 2] == 1 and sum(model.obstacle_map) == 1
+    assert model.has_obstacle((4, 2)) and not model.has_obstacle((4, 3))
+    assert model.has_obstacle((-1, 0)) and model.has_obstacle((10, 0))  # Fuera del grid
+
+
+def test_robot_positions_index_tracks_every_robot_in_a_cell():
+    model = make_model(10, 6, [(1, 1), (3, 3), (3, 4)])
+    first, second, third = model.robots
+    model.move_robot(first, (3, 3))
+    assert set(model.robots_at((3, 3))) == {first, second} and model.robots_at((1, 1)) == []
+    assert model.robot_at((3, 3), exclude=first) is second
+    assert model.robot_at((3, 3), exclude=second) is first
+    model.move_robot(second, (2, 3))
+    assert model.robots_at((3, 3)) == [first] and model.robots_at((2, 3)) == [second]
+    assert set(model.robots_near((3, 3), 1)) == {first, second, third}
+    # El índice coincide con el grid de Mesa
+    for robot in model.robots:
+        assert robot in model.robots_at(robot.pos)
+    assert sum(len(robots) for robots in model.robot_positions.values()) == len(model.robots)
+
+
+def test_distance_field_matches_bfs_after_blocking_cells():
+    width, height = 25, 15
+    blocked_map = random_map(width, height, 0.2, 4)
+    target = free_cells(blocked_map, width, height)[0]
+    field = DistanceField(target, width, height, blocked_map)
+    rng = random.Random(4)
+    for _ in range(25):
+        expected = bfs_distances(blocked_map, width, height, target)
+        for cell in free_cells(blocked_map, width, height):
+            assert field.distance(cell) == expected.get(cell)
+            path = field.path_from(cell)
+            if cell in expected:
+                assert_valid_path(path, cell, target, blocked_map, height)
+                assert len(path) - 1 == expected[cell]
+        # Reparación incremental con un obstáculo nuevo (nunca el destino)
+        x, y = rng.randrange(width), rng.randrange(height)
+        if (x, y) != target:
+            blocked_map[x * height + y] = 1
+            field.block_cell((x, y))
+
+
+def test_adding_an_obstacle_repairs_only_the_routes_that_cross_it():
+    model = make_model(12, 7, [(0, 3), (0, 0)])
+    crossing, other = model.robots
+    crossing.path = [(x, 3) for x in range(12)]
+    other.path = [(x, 0) for x in range(6)]
+    untouched = other.path
+    assert model.add_obstacle((5, 3))
+    assert other.path is untouched  # La ruta que no pasa por la celda no se recalcula
+    assert_valid_path(list(crossing.path), (0, 3), (11, 3), model.obstacle_map, 7)
+    assert len(crossing.path) - 1 == 13  # Rodeo de dos pasos alrededor del obstáculo
+    # La ruta reparada conserva el tramo anterior al obstáculo
+    assert list(crossing.path[:5]) == [(x, 3) for x in range(5)]
+
+
+def test_cooperative_window_plans_have_no_vertex_or_swap_conflicts():
+    model = make_model(8, 5, [(0, 2), (7, 2), (3, 1), (4, 2)], cooperative_planning=True)
+    east, west, south, parked = model.robots
+    for robot, goal in ((east, (7, 2)), (west, (0, 2)), (south, (3, 4))):
+        robot.idle = False
+        robot.path = model.find_static_path(robot.pos, goal)
+    model.plan_cooperative_window()
+    horizon = model.planning_window + 1
+    windows = {robot.unique_id: list(robot.path[:horizon]) for robot in (east, west, south)}
+    windows[parked.unique_id] = [parked.pos]  # Detenido: ocupa su celda toda la ventana
+    assert ConflictBasedSearch.find_conflict(windows) is None
+    for robot in (east, west, south):
+        assert robot.timed_path
+        path = list(robot.path)
+        for a, b in zip(path, path[1:]):
+            assert manhattan(a, b) <= 1  # Paso cardinal o espera
+        assert not any(model.has_obstacle(pos) for pos in path)
+    assert east.path[-1] == (7, 2) and west.path[-1] == (0, 2) and south.path[-1] == (3, 4)
+
+
+def test_cbs_solution_is_conflict_free():
+    width, height = 8, 5
+    blocked_map = bytearray(width * height)
+    for x in range(width):
+        if x != 3:
+            blocked_map[x * height + 2] = 1  # Pared con un único hueco en (3, 2)
+    agents = {
+        1: ((0, 0), (7, 4), manhattan),
+        2: ((7, 4), (0, 0), manhattan),
+        3: ((3, 0), (3, 4), manhattan),
+    }
+    paths = ConflictBasedSearch(width, height, blocked_map, max_nodes=2000, time_budget=5).solve(agents)
+    assert paths is not None
+    assert ConflictBasedSearch.find_conflict(paths) is None
+    for robot_id, (start, goal, _) in agents.items():
+        path = paths[robot_id]
+        assert path[0] == start and path[-1] == goal
+        for a, b in zip(path, path[1:]):
+            assert manhattan(a, b) <= 1  # Paso cardinal o espera
+        assert not any(blocked_map[x * height + y] for x, y in path)
+
+
+def test_cbs_rejects_shared_goals_without_spending_the_budget():
+    blocked_map = bytearray(8 * 5)
+    agents = {1: ((0, 0), (7, 4), manhattan), 2: ((0, 4), (7, 4), manhattan)}
+    solver = ConflictBasedSearch(8, 5, blocked_map, max_nodes=10 ** 6, time_budget=5)
+    assert solver.solve(agents) is None
+    assert solver.failure == "varios robots comparten meta" and solver.nodes_expanded == 0
+
+
+def test_batch_planning_leaves_robots_with_shared_goals_out_of_cbs():
+    model = make_model(10, 5, [(0, 0), (0, 4), (9, 0), (9, 4)], dispatch_planner='cbs')
+    first, second, third, fourth = model.robots
+    for robot in (first, second):
+        robot.change_goal((5, 2))  # Mismo camión
+    third.change_goal((0, 2))
+    fourth.change_goal((5, 4))
+    assert model.plan_batch_paths([first, second, third, fourth])
+    assert not first.timed_path and not second.timed_path
+    assert third.timed_path and fourth.timed_path
+    assert ConflictBasedSearch.find_conflict({3: list(third.path), 4: list(fourth.path)}) is None
+    # Si solo queda un robot no hay nada que coordinar
+    assert not model.plan_batch_paths([first, second, third])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_jump_point_search_finds_shortest_paths(seed):
+    width, height = 30, 20
+    blocked_map = random_map(width, height, 0.25, seed)
+    jps = JumpPointSearch(width, height, blocked_map)
+    for start, goal in sample_queries(width, height, blocked_map, seed):
+        expected = bfs_distances(blocked_map, width, height, start).get(goal)
+        path = jps.search(start, goal)
+        if expected is None:
+            assert path == []
+            continue
+        assert_valid_path(path, start, goal, blocked_map, height)
+        assert len(path) - 1 == expected
+
+
+def test_jps_tables_follow_new_obstacles():
+    width, height = 25, 15
+    blocked_map = random_map(width, height, 0.15, 7)
+    jps = JumpPointSearch(width, height, blocked_map)
+    rng = random.Random(7)
+    for _ in range(30):
+        x, y = rng.randrange(width), rng.randrange(height)
+        blocked_map[x * height + y] = 1
+        jps.invalidate((x, y))
+        for start, goal in sample_queries(width, height, blocked_map, rng.random(), count=5):
+            expected = bfs_distances(blocked_map, width, height, start).get(goal)
+            path = jps.search(start, goal)
+            assert (len(path) - 1 if path else None) == expected
+
+
+def test_hierarchical_paths_are_valid_and_never_shorter_than_optimal():
+    width, height = 60, 40
+    blocked_map = random_map(width, height, 0.2, 3)
+    planner = HierarchicalPlanner(width, height, blocked_map)
+    for start, goal in sample_queries(width, height, blocked_map, 3, count=20):
+        expected = bfs_distances(blocked_map, width, height, start).get(goal)
+        path = planner.find_path(start, goal)
+        if expected is None:
+            assert path == []
+            continue
+        assert_valid_path(path, start, goal, blocked_map, height)
+        assert len(path) - 1 >= expected
+
+
+def test_static_paths_stay_optimal_with_hierarchical_planning():
+    model = make_model(80, 60, [(0, 0)], hierarchical_planning=True)
+    assert model.hierarchical_planner is not None
+    assert make_model(80, 60, [(0, 0)]).hierarchical_planner is None  # Solo si se pide
+    for y in range(5, 55):
+        model.add_obstacle((40, y))
+    distances = bfs_distances(model.obstacle_map, 80, 60, (0, 30))
+    for goal in ((79, 30), (60, 2), (45, 57)):
+        path = model.find_static_path((0, 30), goal)
+        assert len(path) - 1 == distances[goal]
+
+
+def test_static_path_cache_is_invalidated_by_new_obstacles():
+    model = make_model(10, 5, [(0, 0)])
+    model.path_cache_size = 2
+    path = model.find_static_path((0, 2), (9, 2))
+    path.pop()  # Los robots consumen sus rutas: la caché devuelve copias
+    assert model.find_static_path((0, 2), (9, 2)) == [(x, 2) for x in range(10)]
+    assert model.get_path_cache_stats()['hits'] == 1
+    version = model.map_version
+    assert model.add_obstacle((5, 2))
+    assert model.map_version == version + 1
+    detour = model.find_static_path((0, 2), (9, 2))
+    assert (5, 2) not in detour and len(detour) - 1 == 11
+    # Las entradas de versiones anteriores ya no se consultan y salen por LRU
+    model.find_static_path((0, 0), (9, 4))
+    assert ((0, 2), (9, 2), version) not in model.path_cache and len(model.path_cache) == 2
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_landmark_heuristic_is_admissible(seed):
+    width, height = 30, 20
+    blocked_map = random_map(width, height, 0.25, seed)
+    landmarks = LandmarkHeuristic(width, height, blocked_map)
+    for start, goal in sample_queries(width, height, blocked_map, seed):
+        expected = bfs_distances(blocked_map, width, height, start).get(goal)
+        estimate = landmarks.heuristic(start, goal)
+        if expected is None:
+            continue
+        assert manhattan(start, goal) <= estimate <= expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_wavefront_matches_bfs_and_distance_fields(seed):
+    width, height = 25, 15
+    blocked_map = random_map(width, height, 0.25, seed)
+    source = free_cells(blocked_map, width, height)[seed]
+    expected = bfs_distances(blocked_map, width, height, source)
+    distances = wavefront_distances(blocked_map, width, height, source)
+    for x in range(width):
+        for y in range(height):
+            assert distances[x, y] == expected.get((x, y), -1)
+    # Con carriles las distancias hasta source son las del campo BFS inverso
+    rng = random.Random(seed)
+    lane_map = bytearray(rng.choice((0, 0, 1, 2, 4, 8, 3, 12)) for _ in range(width * height))
+    toward = wavefront_distances(blocked_map, width, height, source, lane_map, toward_source=True)
+    field = DistanceField(source, width, height, blocked_map, lane_map)
+    for x in range(width):
+        for y in range(height):
+            distance = field.distance((x, y))
+            assert toward[x, y] == (-1 if distance is None else distance)
+
+
+def test_wavefronts_are_shared_per_target_and_follow_the_map():
+    model = make_model(10, 5, [(0, 0), (0, 4)])
+    first, second = model.robots
+    assert first.path_distance_to((9, 2)) == 11 and second.path_distance_to((9, 2)) == 11
+    assert list(model.wavefronts) == [(9, 2)]  # Un solo frente para los dos robots
+    for y in range(4):
+        model.add_obstacle((5, y))
+    assert first.path_distance_to((9, 2)) == 15
+    assert first.path_distance_to((0, 0)) == 0 and len(model.wavefronts) == 2
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bidirectional_search_matches_astar_lengths(seed):
+    width, height = 30, 20
+    blocked_map = random_map(width, height, 0.25, seed)
+    astar = AStarSearch(width, height, blocked_map)
+    blocked_cells = set(random.Random(seed).sample(free_cells(blocked_map, width, height), 40))
+    is_passable = lambda pos: pos not in blocked_cells  # Robots detenidos
+    bidirectional = BidirectionalSearch(width, height, blocked_map, is_passable)
+    robot_aware = AStarSearch(width, height, blocked_map, is_passable)
+    for start, goal in sample_queries(width, height, blocked_map, seed):
+        for planner, reference in ((BidirectionalSearch(width, height, blocked_map), astar),
+                                   (bidirectional, robot_aware)):
+            expected = reference.search(start, goal)
+            path = planner.search(start, goal)
+            assert len(path) == len(expected)
+            if path:
+                assert_valid_path(path, start, goal, blocked_map, height)
+                assert all(planner.can_enter(pos) for pos in path[1:])
+
+
+def test_search_budget_returns_a_partial_path_toward_the_goal():
+    width, height = 40, 30
+    blocked_map = bytearray(width * height)
+    for y in range(1, height):
+        blocked_map[20 * height + y] = 1  # Pared con el hueco en y = 0
+    budget = SearchBudget(max_expansions=50)
+    search = AStarSearch(width, height, blocked_map, budget=budget)
+    path = search.search((0, 29), (39, 29))
+    assert search.partial and budget.exhausted and search.nodes_expanded == 50
+    assert path[0] == (0, 29) and path[-1] != (39, 29)
+    for a, b in zip(path, path[1:]):
+        assert manhattan(a, b) == 1
+    # La ruta parcial acaba en el nodo expandido más cercano a la meta
+    assert manhattan(path[-1], (39, 29)) < manhattan((0, 29), (39, 29))
+    # El presupuesto es compartido: las búsquedas siguientes ya no expanden nada
+    follow_up = AStarSearch(width, height, blocked_map, budget=budget)
+    assert follow_up.search((0, 0), (5, 5)) == [(0, 0)] and follow_up.partial
+    # Sin presupuesto la misma búsqueda llega a la meta
+    assert AStarSearch(width, height, blocked_map).search((0, 29), (39, 29))[-1] == (39, 29)
+
+
+def test_replanning_budget_is_cleared_even_if_the_search_fails():
+    model = make_model(10, 5, [(0, 0)])
+    robot = model.robots[0]
+    robot.path = [(0, 0), (1, 0)]
+    robot.partial_destination, robot.partial_tail = (9, 4), (1, 0)
+
+    def failing_astar(start, goal):
+        assert robot.search_budget is not None
+        raise RuntimeError("fallo simulado")
+
+    robot.astar = failing_astar
+    with pytest.raises(RuntimeError):
+        robot.resume_partial_route()
+    assert robot.search_budget is None
+
+
+def test_robot_path_behaves_like_the_list_it_replaces():
+    cells = [(0, 0), (0, 1), (1, 1), (2, 1), (2, 2)]
+    path = RobotPath(cells, height=5)
+    expected = list(cells)
+    for _ in range(40):
+        path.append((3, 2))
+        expected.append((3, 2))
+    while len(expected) > 3:
+        assert path.pop(0) == expected.pop(0)  # Solo avanza el cursor
+    path.insert(0, (4, 4))
+    expected.insert(0, (4, 4))
+    assert path == expected and list(path) == expected and len(path) == len(expected)
+    assert path[1:] == expected[1:] and path[-1] == expected[-1] and (4, 4) in path
+    assert path.index((3, 2)) == expected.index((3, 2))
+    assert path + [(4, 2)] == expected + [(4, 2)] and [(8, 8)] + path == [(8, 8)] + expected
+    assert path.to_flat() == [value for pos in expected for value in pos]
+
+
+def test_astar_writes_its_path_straight_into_a_robot_path():
+    came_from = {(0, 1): (0, 0), (1, 1): (0, 1), (2, 1): (1, 1)}
+    path = RobotPath.from_parents(came_from, (2, 1), height=5)
+    assert path == [(0, 0), (0, 1), (1, 1), (2, 1)]
+    assert path.fingerprint() == RobotPath([(0, 0), (0, 1), (1, 1), (2, 1)], height=5).fingerprint()
+    found = AStarSearch(6, 5, bytearray(30)).search((0, 0), (5, 4))
+    assert isinstance(found, RobotPath) and len(found) == 10 and found[0] == (0, 0) and found[-1] == (5, 4)
+
+
+def test_robot_path_fingerprint_tracks_remaining_route():
+    cells = [(0, 0), (0, 1), (1, 1), (2, 1), (2, 2)]
+    path = RobotPath(cells, height=5)
+    assert path == cells
+    assert path.fingerprint() == RobotPath(cells, height=5).fingerprint()
+    path.pop(0)
+    assert path.fingerprint() == RobotPath(cells[1:], height=5).fingerprint()
+    path.append((2, 3))
+    assert path.fingerprint() == RobotPath(cells[1:] + [(2, 3)], height=5).fingerprint()
+    assert path.fingerprint() != RobotPath(cells[1:] + [(3, 2)], height=5).fingerprint()
+    # Una ruta probada se reconoce aunque llegue como lista
+    robot = make_model(5, 5, [(0, 0)]).robots[0]
+    robot.path = cells
+    robot.alternative_paths_tried[robot.path.fingerprint()] = True
+    assert robot.path_in_tried_alternatives(list(cells))
+    assert not robot.path_in_tried_alternatives(cells[:-1]) and not robot.path_in_tried_alternatives([])
+
+
+class Warehouse(PathFindingModel):
+    """Modelo con camiones y puntos de entrega fijos, como los que define server.py"""
+    def get_truck_positions(self):
+        return [(0, 9), (15, 9)]
+
+    def get_delivery_positions(self):
+        return [(x, y) for x in (3, 7, 11) for y in (2, 5)]
+
+
+def run_warehouse(seed, steps=250):
+    """Simulación corta sin servidor; devuelve las posiciones de cada paso y las entregas"""
+    robots = [{'start': [x, 0], 'goal': [x, 0]} for x in (1, 5, 9, 13)]
+    model = Warehouse(16, 10, robots, [(15, 0)], seed=seed)
+    model.replan_time_budget = None  # Sin cortes por reloj, que no son reproducibles
+    for x in (2, 4, 6, 8, 10, 12):
+        for y in range(1, 7):
+            model.add_obstacle((x, y))
+    for _ in range(40):
+        model.create_package(model.random.choice(model.get_truck_positions()),
+                             model.random.choice(model.get_delivery_positions()))
+    trace = []
+    for _ in range(steps):
+        idle = [robot for robot in model.robots if robot.idle and not robot.charging and not robot.carrying_package]
+        waiting = model.get_available_packages(len(idle))
+        model.assign_packages_batch([(package.id, robot.unique_id) for package, robot in zip(waiting, idle)])
+        model.step()
+        trace.append(tuple(robot.pos for robot in model.robots))
+    delivered = [(package.id, package.delivery_time) for package in model.delivered_packages]
+    return trace, delivered
+
+
+def test_same_seed_gives_identical_runs():
+    first_trace, first_delivered = run_warehouse(seed=5)
+    second_trace, second_delivered = run_warehouse(seed=5)
+    assert first_delivered and first_delivered == second_delivered
+    assert first_trace == second_trace
+
+
+def test_seed_uses_the_mesa_randomizer():
+    model = make_model(5, 5, [(0, 0)], seed=11)
+    assert model._seed == 11 and model.random.random() == make_model(5, 5, [(0, 0)], seed=11).random.random()
+    # También por posición: Model.__new__ de Mesa solo ve seed=...
+    positional = PathFindingModel(5, 5, [{'start': [0, 0], 'goal': [0, 0]}], None, False, 8, 'individual', 11)
+    assert positional._seed == 11
+
+
+def test_flow_field_robots_descend_the_field_and_report_their_eta():
+    model = make_model(10, 5, [(0, 4)], charging_station_positions=[(9, 4)], flow_field_navigation=True)
+    robot, station = model.robots[0], model.charging_stations[0]
+    for y in range(1, 5):
+        model.add_obstacle((5, y))  # Pared con el hueco en y = 0
+    robot.path = robot.plan_route(robot.pos, station.pos)
+    assert robot.in_flow_mode() and len(robot.path) == 2  # Solo el paso siguiente
+    distance = model.get_distance_field(station.pos).distance(robot.pos)
+    steps, charge = robot.charging_eta(station)
+    assert steps == distance == 17
+    assert charge == station.charge_steps(robot.charge_deficit(robot.battery_level - 17 * robot.battery_drain_rate))
+    moves = 0
+    while robot.pos != station.pos:
+        next_pos = robot.path[1]
+        assert model.get_distance_field(station.pos).distance(next_pos) == distance - moves - 1
+        model.move_robot(robot, next_pos)
+        robot.path.pop(0)
+        robot.follow_flow_field()
+        moves += 1
+        if robot.pos != station.pos:
+            assert robot.charging_eta(station)[0] == distance - moves
+    assert moves == distance
+
+
+def test_congestion_heat_decays_and_steers_routes_around_jams():
+    congestion = CongestionMap(5, 5, decay=0.5)
+    congestion.record((2, 2), 4.0)
+    congestion.tick()
+    assert congestion.value((2, 2)) == pytest.approx(2.0)
+    for _ in range(40):
+        congestion.tick()  # Renormaliza cuando la escala se hace muy pequeña
+    assert congestion.scale > 1e-6 and congestion.value((2, 2)) < 1e-9
+
+    model = make_model(10, 5, [(0, 2)], congestion_weight=2.0)
+    robot = model.robots[0]
+    assert robot.astar((0, 2), (9, 2)) == [(x, 2) for x in range(10)]
+    for _ in range(3):
+        model.congestion.record((5, 2))
+    detour = robot.astar((0, 2), (9, 2))
+    assert (5, 2) not in detour and len(detour) - 1 == 11
+    model.congestion_weight = 0.0  # Sin peso el mapa de calor no cambia las rutas
+    assert robot.astar((0, 2), (9, 2)) == [(x, 2) for x in range(10)]
+
+
+def test_lanes_restrict_moves_planners_and_distance_fields():
+    model = make_model(6, 3, [(0, 0)], charging_station_positions=[(0, 1)])
+    field = model.get_distance_field((0, 1))
+    assert field.distance((5, 1)) == 5
+    version = model.map_version
+    # Fila central solo hacia +x: para volver a (0, 1) hay que salir por otra fila
+    assert model.set_lanes([((x, 1), [(1, 0), [0, 1], (0, -1)]) for x in range(6)]) == 6
+    assert model.map_version == version + 1
+    assert model.can_move((2, 1), (3, 1)) and not model.can_move((3, 1), (2, 1))
+    assert model.can_move((3, 1), (3, 1)) and model.can_move((3, 0), (2, 0))  # Esperar; celda sin carril
+    assert field.distance((5, 1)) == 7  # El campo se reconstruye con los carriles
+    path = model.find_static_path((5, 1), (0, 1))
+    assert len(path) - 1 == 7 and all(model.can_move(a, b) for a, b in zip(path, path[1:]))
+    assert model.set_lanes([((x, 1), [(1, 0), (0, 1), (0, -1)]) for x in range(6)]) == 0
+
+
+def test_unknown_lane_directions_are_rejected():
+    model = make_model(6, 3, [(0, 0)])
+    with pytest.raises(ValueError):
+        model.set_lanes([((1, 1), [(1, 0)]), ((2, 1), ['east'])])
+    with pytest.raises(ValueError):
+        model.set_lanes([((2, 1), [(2, 0)])])
+    assert model.lane_map is None  # Ningún carril aplicado a medias
+
+
+def test_package_store_tracks_changes_only_when_asked():
+    store = PackageStore()
+    store.create(9, (0, 0), (2, 3)).status = 'assigned'
+    assert store.changed_rows is None and store.take_changes() == []  # Sin seguimiento no se acumula nada
+    store.track_changes()
+    package = store.create(10, (0, 0), (2, 3))
+    assert [changed.id for changed in store.take_changes()] == [10]
+    assert store.take_changes() == []
+    package.status = 'assigned'
+    package.assigned_robot_id = 4
+    store.get(9).status = 'picked'
+    assert [(changed.id, changed.status) for changed in store.take_changes()] == [(9, 'picked'), (10, 'assigned')]
+    package.assigned_robot_id = 5  # Solo los cambios de estado cuentan
+    assert store.take_changes() == []
+
+
+def test_package_store_queue_order():
+    store = PackageStore(capacity=2)
+    packages = [store.create(package_id, (0, 0), (1, 1)) for package_id in range(1, 6)]
+    assert [package.id for package in store.with_status('waiting')] == [1, 2, 3, 4, 5]
+
+    # Un paquete devuelto a espera vuelve al final de la cola
+    packages[0].status = 'assigned'
+    packages[0].status = 'waiting'
+    assert [package.id for package in store.with_status('waiting')] == [2, 3, 4, 5, 1]
+
+    packages[2].status = 'assigned'
+    assert [package.id for package in store.with_status('waiting', 2)] == [2, 4]
+    packages[2].status = 'waiting'
+    for package_id in range(6, 40):
+        store.create(package_id, (0, 0), (1, 1))
+    waiting = [package.id for package in store.with_status('waiting')]
+    assert waiting[:6] == [2, 4, 5, 1, 3, 6] and len(waiting) == 39
+    assert store.count('waiting') == 39
+
+
+def test_package_views_are_created_on_demand():
+    store = PackageStore()
+    for package_id in range(100):
+        store.create(package_id, (0, 0), (1, 1))
+    assert len(store.views) == 0  # Ninguna vista sobrevive si nadie la usa
+    package = store.get(42)
+    assert store.get(42) is package and store.with_status('waiting')[42] is package
+    assert store.get(42) == store.view(42) and len({store.get(42), package}) == 1
+    del package
+    assert len(store.views) == 0
+    delivered = PackageRows(store)
+    for package_id in (7, 3):
+        store.get(package_id).status = 'delivered'
+        delivered.append(store.get(package_id))
+    assert [package.id for package in delivered] == [7, 3] and len(delivered) == 2
+    assert [package.id for package in [] + delivered] == [7, 3]
+
+
+def test_package_store_counts_and_delivery_stats():
+    store = PackageStore()
+    packages = [store.create(package_id, (0, 0), (1, 1)) for package_id in (3, 1, 2)]  # Ids desordenados
+    assert [store.get(package_id).id for package_id in (1, 2, 3)] == [1, 2, 3] and store.get(4) is None
+    for step, package in enumerate(packages):
+        package.status = 'assigned'
+        package.assignment_time = step
+        package.status = 'picked'
+        package.pickup_time = step + 2
+    packages[0].status = 'delivered'
+    packages[0].delivery_time = 7
+    assert store.count('picked') == 2 and store.count_active() == 2
+    assert [package.id for package in store.active_packages()] == [1, 2]
+    stats = store.delivery_stats()
+    assert 'count' not in stats and stats['delivered_in_store'] == 1
+    assert stats['avg_delivery_time'] == 5 and stats['avg_total_process'] == 7
+
+
+def test_robots_and_stations_are_indexed_by_id_and_position():
+    model = make_model(8, 5, [(0, 0), (7, 4)], charging_station_positions=[[3, 0]])
+    first, second = model.robots
+    assert model.get_robot(first.unique_id) is first and model.get_robot(second.unique_id) is second
+    assert model.get_robot(99) is None
+    assert model.get_station_at((3, 0)) is model.charging_stations[0] and model.get_station_at((3, 1)) is None
+    assert model.add_charging_station([5, 2]) and not model.add_charging_station((5, 2))
+    model.add_obstacle((6, 2))
+    assert not model.add_charging_station((6, 2))
+    assert model.get_station_at((5, 2)).pos == (5, 2) and len(model.charging_stations) == 2
+    assert not model.add_obstacle((5, 2))  # Una estación no se puede tapar
+    assert (5, 2) in model.get_static_targets()
+
+
+def test_charging_queue_positions():
+    station = ChargingStation((0, 0))
+    for robot_id in (1, 2, 3, 4):
+        station.add_to_queue(robot_id)
+    station.remove_from_queue(2)
+    assert [station.position_of(robot_id) for robot_id in (1, 2, 3, 4)] == [0, None, 1, 2]
+    assert station.start_charging(1)
+    assert [station.position_of(robot_id) for robot_id in (3, 4)] == [0, 1]
+    station.add_to_queue(5)
+    assert station.position_of(5) == 2
+
+
+def test_charging_queue_positions_match_a_plain_list():
+    station = ChargingStation((0, 0))
+    queue = []
+    rng = random.Random(2)
+    for _ in range(2000):
+        robot_id = rng.randrange(12)
+        action = rng.random()
+        if action < 0.45:
+            if station.add_to_queue(robot_id):
+                queue.append(robot_id)
+        elif action < 0.75:
+            if station.remove_from_queue(robot_id):
+                queue.remove(robot_id)
+        elif station.current_robot is None:
+            if queue and station.start_charging(queue[0]):
+                queue.pop(0)
+        else:
+            station.finish_charging(station.current_robot)
+        for other in range(12):
+            assert station.position_of(other) == (queue.index(other) if other in queue else None)
+        assert len(station.removed_tickets) <= len(queue)
+
+
+def test_charging_bookings_predict_start():
+    station = ChargingStation((0, 0), charging_rate=10)
+    station.book_slot(1, arrival=5, charge_steps=4)
+    station.book_slot(2, arrival=3, charge_steps=2)
+    slots, free_at = station.timeline(0, {})
+    # Orden de la cola: el robot 2 espera a que termine el 1 aunque llegue antes
+    assert slots == [(1, 5, 9), (2, 9, 11)] and free_at == 11
+    assert station.predicted_start(0, 20, {}) == 20
+    assert station.predicted_start(0, 1, {}) == 11
+    # Las reservas pasadas no se quedan en el pasado
+    assert station.timeline(30, {})[1] == 36
+
+
+def test_charging_timeline_follows_the_live_route_of_booked_robots():
+    model = make_model(12, 3, [(0, 1)], charging_station_positions=[(11, 1)])
+    robot, station = model.robots[0], model.charging_stations[0]
+    robot.battery_level = 40
+    robot.book_charging_slot(station)
+    (robot_id, start, end), = station.timeline(0, model.robots_by_id)[0]
+    assert robot_id == robot.unique_id and start == 11
+    # La reserva dice 11 pasos, pero la ruta real hacia la estación es más corta
+    model.move_robot(robot, (6, 1))
+    robot.path = [(x, 1) for x in range(6, 12)]
+    slots, free_at = station.timeline(0, model.robots_by_id)
+    assert slots[0][1] == 5 and free_at == 5 + robot.charging_eta(station)[1]